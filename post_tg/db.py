@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
@@ -11,15 +12,59 @@ DB_PORT   = os.getenv("DB_PORT", "5432")
 
 if DB_ENGINE == "sqlite":
     DATABASE_URL = f"sqlite:///{os.getenv('SQLITE_PATH', '/db.sqlite3')}"
+    ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{os.getenv('SQLITE_PATH', '/db.sqlite3')}"
 else:
     DATABASE_URL = f"{DB_ENGINE}+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    ASYNC_DATABASE_URL = f"{DB_ENGINE}+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL, echo=False, future=True)
+# Пул соединений: LIFO держит небольшой «тёплый» набор соединений, лишние закрываются быстрее.
+# Значения настраиваются через env под количество трекеров в деплое.
+if DB_ENGINE == "sqlite":
+    POOL_OPTIONS = {}
+else:
+    POOL_OPTIONS = dict(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "3600")),
+        pool_pre_ping=True,
+        pool_use_lifo=True,
+    )
+
+# Отдельный, меньший пул для async-движка: он нужен лишь части корутин и не должен удваивать
+# число соединений процесса к БД
+if DB_ENGINE == "sqlite":
+    ASYNC_POOL_OPTIONS = {}
+else:
+    ASYNC_POOL_OPTIONS = dict(
+        POOL_OPTIONS,
+        pool_size=int(os.getenv("DB_ASYNC_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "5")),
+    )
+
+engine = create_engine(DATABASE_URL, echo=False, future=True, **POOL_OPTIONS)
 SessionLocal = sessionmaker(
                 bind=engine,
                 autoflush=False,
                 autocommit=False,
                 expire_on_commit=False
             )
+
+# Асинхронный движок для вызовов из корутин (не блокирует event loop).
+# Создаётся при первом обращении: процессам без async-сессий не нужны ни пул, ни драйвер
+_async_session_factory = None
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    global _async_session_factory
+    if _async_session_factory is None:
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False, **ASYNC_POOL_OPTIONS)
+        _async_session_factory = async_sessionmaker(
+                bind=async_engine,
+                class_=AsyncSession,
+                autoflush=False,
+                expire_on_commit=False
+            )
+    return _async_session_factory
+
 Base = declarative_base()
 
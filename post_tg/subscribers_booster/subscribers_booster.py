@@ -1,7 +1,11 @@
 # subscribers_booster.py
 
 import os
+import time
+import heapq
+import random
 import asyncio
+import itertools
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Set
@@ -12,12 +16,13 @@ from telethon import functions, types
 from telethon.tl.types import Channel, Chat, MessageService
 from telethon.errors import FloodWaitError
 import aiohttp
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, bindparam
 from sqlalchemy.orm import joinedload, selectinload
 
-from utils.db_utils import get_session
+from utils.db_utils import get_session, get_async_session
 from telegram_client import init_user_client
 from entity_resolver import ensure_peer
+from db_notify import listen_tasks_changed
 from models import (SubscribersBoostTask, SubscribersCheck, BoosterServiceRotation,
                    SubscribersBoostExpense, MainEntity, BotSession, BoosterSettings, BoosterTariff)
 from models import BoosterOrder
@@ -29,12 +34,27 @@ log = logging.getLogger("subscribers_booster")
 log.info(get_session)
 # Константы
 DEFAULT_CHECK_INTERVAL = int(os.getenv("SUBSCRIBERS_CHECK_INTERVAL", "60"))
+# Изменения настроек бустера из админки подхватываются по истечении TTL: триггеров pg_notify
+# на booster_settings / booster_tariffs нет
+SETTINGS_TTL = int(os.getenv("SUBSCRIBERS_SETTINGS_TTL", "30"))
+SCHEDULER_TICK = 5
+UPDATES_MIN_INTERVAL = 60
+UPDATES_MAX_INTERVAL = 900
+BACKOFF_BASE = 60
+BACKOFF_MAX = 900
+PERIODIC_CHECK_CONCURRENCY = int(os.getenv("SUBSCRIBERS_CHECK_CONCURRENCY", "32"))
+ADMIN_LOG_POLL_INTERVAL = 60
+ADMIN_LOG_CONCURRENCY = int(os.getenv("SUBSCRIBERS_ADMIN_LOG_CONCURRENCY", "3"))
 TZ = pytz.timezone(os.getenv("TZ", "Europe/Moscow"))
 UTC_TZ = pytz.UTC
 
 # Настройки прокси
 PROXY_URL = os.getenv("HTTP_PROXY") or os.getenv("HTTPS_PROXY")
 
+TWIBOOST_API_URL = "https://twiboost.com/api/v2"
+# Доверять цене тарифа (price_per_1000) и не запрашивать charge через status
+TRUST_TARIFF_PRICES = os.getenv("TRUST_TARIFF_PRICES", "false").lower() in ("1", "true", "yes")
+
 def get_booster_settings(session) -> Optional[BoosterSettings]:
     """Получает глобальные настройки бустера из БД с использованием существующей сессии"""
     try:
@@ -43,7 +63,7 @@ def get_booster_settings(session) -> Optional[BoosterSettings]:
             .options(
                 selectinload(BoosterSettings.tariffs),
             )
-        ).unique().scalar_one_or_none()
+        ).scalar_one_or_none()
         
         if settings:
             # Проверяем критически важные поля
@@ -64,8 +84,32 @@ def get_booster_settings(session) -> Optional[BoosterSettings]:
         return None
 
 
-async def api_send_subscribers(subscribers_count: int, channel_link: str, api_key: str, service_id: int, task_id: int) -> Tuple[Optional[str], float]:
-    """Отправляет запрос на API для накрутки подписчиков через прокси."""
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером: случайное значение в [0, min(base * 2^attempt, max)]"""
+    return random.uniform(0, min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX))
+
+
+def get_tariff_price(settings: BoosterSettings, service_id: int) -> Optional[float]:
+    """Возвращает price_per_1000 активного тарифа для service_id из уже загруженных настроек"""
+    for tariff in settings.tariffs:
+        if tariff.service_id == service_id and tariff.is_active:
+            return tariff.price_per_1000
+    return None
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Общая HTTP-сессия для API бустера: keep-alive и кэш DNS вместо нового соединения на каждый запрос"""
+    return aiohttp.ClientSession(
+        headers={"User-Agent": "Mozilla/5.0", "Accept": "application/json,text/plain,*/*"},
+        timeout=aiohttp.ClientTimeout(total=15),
+        connector=aiohttp.TCPConnector(ssl=False, limit=50, ttl_dns_cache=300, keepalive_timeout=60),
+    )
+
+
+async def api_send_subscribers(http: aiohttp.ClientSession, subscribers_count: int, channel_link: str, api_key: str,
+                               service_id: int, task_id: int,
+                               price_per_1000: Optional[float] = None) -> Tuple[Optional[str], float]:
+    """Отправляет запрос на API для накрутки подписчиков через прокси (по общей сессии http)."""
     try:
         if not api_key:
             log.error("❌ API KEY не установлен в настройках")
@@ -75,100 +119,112 @@ async def api_send_subscribers(subscribers_count: int, channel_link: str, api_ke
             log.error(f"❌ Некорректный service_id: {service_id}")
             return None, 0.0
 
-        base_urls = ["https://twiboost.com/api/v2"]
-        headers = {"User-Agent": "Mozilla/5.0", "Accept": "application/json,text/plain,*/*"}
+        base_urls = [TWIBOOST_API_URL]
 
         for base in base_urls:
             try:
-                add_url = f"{base}?action=add&service={service_id}&link={channel_link}&quantity={subscribers_count}&key={api_key}"
+                # Параметры передаём словарём: aiohttp кодирует их один раз (и безопасно для ссылок)
+                add_params = {
+                    "action": "add",
+                    "service": service_id,
+                    "link": channel_link,
+                    "quantity": subscribers_count,
+                    "key": api_key,
+                }
                 log.info(f"📊 Отправка API запроса для подписчиков: service_id={service_id}, quantity={subscribers_count}")
 
-                connector = aiohttp.TCPConnector(ssl=False)
-                timeout = aiohttp.ClientTimeout(total=15)
+                async with http.get(base, params=add_params, proxy=PROXY_URL) as response:
+                    text = await response.text()
+                    if response.status != 200:
+                        log.error(f"❌ Ошибка API (subscribers): статус {response.status}, ответ: {text}")
+                        continue
 
-                async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
-                    async with session.get(add_url, proxy=PROXY_URL) as response:
-                        text = await response.text()
-                        if response.status != 200:
-                            log.error(f"❌ Ошибка API (subscribers): статус {response.status}, ответ: {text}")
-                            continue
+                    try:
+                        result = await response.json(content_type=None)
+                    except Exception as e:
+                        log.error(f"⚠️ Некорректный JSON ответ (subscribers): {text}, ошибка: {e}")
+                        continue
 
-                        try:
-                            result = await response.json(content_type=None)
-                        except Exception as e:
-                            log.error(f"⚠️ Некорректный JSON ответ (subscribers): {text}, ошибка: {e}")
-                            continue
+                    order_id = result.get("order")
+                    if not order_id:
+                        log.error(f"❌ Ответ без 'order': {result}")
+                        continue
 
-                        order_id = result.get("order")
-                        if not order_id:
-                            log.error(f"❌ Ответ без 'order': {result}")
-                            continue
+                    log.info(f"✅ Заказ на подписчиков создан успешно, order={order_id}")
+
+                    # Сохраняем заказ в БД
+                    try:
+                        await save_booster_order(
+                            task_id=task_id,
+                            task_type="subscribers",
+                            service_id=service_id,
+                            external_order_id=str(order_id),
+                            quantity=subscribers_count,
+                            price=0.0,  # Пока неизвестно, обновим позже
+                            expense_id=None  # Можно передать позже
+                        )
+                    except Exception as e:
+                        log.error(f"❌ Ошибка сохранения заказа в БД: {e}")
 
-                        log.info(f"✅ Заказ на подписчиков создан успешно, order={order_id}")
+                    # Цена тарифа известна и ей доверяем — status не нужен
+                    if TRUST_TARIFF_PRICES and price_per_1000 and price_per_1000 > 0:
+                        charge = (price_per_1000 / 1000) * subscribers_count
+                        log.info(f"💰 Цена по тарифу без запроса status: {charge:.4f} (price_per_1000={price_per_1000})")
+                        return str(order_id), float(charge)
+
+                    # ВАЖНО: Ждем немного перед проверкой статуса
+                    await asyncio.sleep(2)
+                    
+                    status_params = {"action": "status", "order": order_id, "key": api_key}
+                    async with http.get(base, params=status_params, proxy=PROXY_URL) as status_response:
+                        status_text = await status_response.text()
+                        if status_response.status != 200:
+                            log.error(f"❌ Ошибка API (status): {status_response.status}, ответ: {status_text}")
+                            continue
 
-                        # Сохраняем заказ в БД
                         try:
-                            await save_booster_order(
-                                task_id=task_id,
-                                task_type="subscribers",
-                                service_id=service_id,
-                                external_order_id=str(order_id),
-                                quantity=subscribers_count,
-                                price=0.0,  # Пока неизвестно, обновим позже
-                                expense_id=None  # Можно передать позже
-                            )
+                            status_data = await status_response.json(content_type=None)
                         except Exception as e:
-                            log.error(f"❌ Ошибка сохранения заказа в БД: {e}")
+                            log.error(f"⚠️ Некорректный JSON ответ (status): {status_text}, ошибка: {e}")
+                            continue
 
-                        # ВАЖНО: Ждем немного перед проверкой статуса
-                        await asyncio.sleep(2)
-                        
-                        status_url = f"{base}?action=status&order={order_id}&key={api_key}"
-                        async with session.get(status_url, proxy=PROXY_URL) as status_response:
-                            status_text = await status_response.text()
-                            if status_response.status != 200:
-                                log.error(f"❌ Ошибка API (status): {status_response.status}, ответ: {status_text}")
-                                continue
-
-                            try:
-                                status_data = await status_response.json(content_type=None)
-                            except Exception as e:
-                                log.error(f"⚠️ Некорректный JSON ответ (status): {status_text}, ошибка: {e}")
-                                continue
-
-                            # Обрабатываем разные форматы ответа
-                            charge = 0.0
-                            if isinstance(status_data, dict):
+                        # Обрабатываем разные форматы ответа
+                        charge = 0.0
+                        if isinstance(status_data, dict):
+                            if status_data.get("charge"):
+                                # Одиночный заказ: {"status": "...", "charge": ...}
+                                charge = float(status_data["charge"])
+                            else:
                                 # Стандартный формат: {"order_id": {"status": "...", "charge": ...}}
-                                for order_key, order_data in status_data.items():
-                                    if isinstance(order_data, dict):
-                                        charge = order_data.get("charge", 0.0)
-                                        if charge:
-                                            break
-                            elif "charge" in str(status_data):
-                                # Альтернативный формат
-                                import re
-                                charge_match = re.search(r'"charge"\s*:\s*([\d\.]+)', str(status_data))
-                                if charge_match:
-                                    charge = float(charge_match.group(1))
-
-                            if charge == 0:
-                                log.warning(f"⚠️ Цена (charge) не найдена в ответе: {status_data}")
-                                # Используем расчетную цену
-                                with get_session() as db_session:
-                                    from models import BoosterTariff
-                                    tariff = db_session.execute(
-                                        select(BoosterTariff)
-                                        .where(BoosterTariff.service_id == service_id)
-                                        .where(BoosterTariff.is_active == True)
-                                    ).scalar_one_or_none()
-                                    
-                                    if tariff and tariff.price_per_1000 > 0:
-                                        charge = (tariff.price_per_1000 / 1000) * subscribers_count
-                                        log.info(f"💰 Используем расчетную цену: {charge:.4f} (на основе tariff.price_per_1000={tariff.price_per_1000})")
-
-                            log.info(f"💰 Получена цена (charge) за подписчиков: {charge}")
-                            return str(order_id), float(charge)
+                                for order_data in status_data.values():
+                                    if isinstance(order_data, dict) and order_data.get("charge"):
+                                        charge = float(order_data["charge"])
+                                        break
+                        elif isinstance(status_data, list):
+                            # Альтернативный формат: [{"charge": ...}, ...]
+                            for item in status_data:
+                                if isinstance(item, dict) and item.get("charge"):
+                                    charge = float(item["charge"])
+                                    break
+                        else:
+                            log.warning(f"⚠️ Неизвестный формат ответа status: {type(status_data).__name__}")
+
+                        if charge == 0:
+                            log.warning(f"⚠️ Цена (charge) не найдена в ответе: {status_data}")
+                            # Используем расчетную цену
+                            async with get_async_session() as db_session:
+                                tariff = (await db_session.execute(
+                                    select(BoosterTariff)
+                                    .where(BoosterTariff.service_id == service_id)
+                                    .where(BoosterTariff.is_active == True)
+                                )).scalar_one_or_none()
+                                
+                                if tariff and tariff.price_per_1000 > 0:
+                                    charge = (tariff.price_per_1000 / 1000) * subscribers_count
+                                    log.info(f"💰 Используем расчетную цену: {charge:.4f} (на основе tariff.price_per_1000={tariff.price_per_1000})")
+
+                        log.info(f"💰 Получена цена (charge) за подписчиков: {charge}")
+                        return str(order_id), float(charge)
 
             except Exception as e:
                 log.error(f"❌ Ошибка при работе с базовым URL {base}: {e}")
@@ -192,9 +248,7 @@ async def save_booster_order(
 ) -> bool:
     """Сохраняет заказ в таблицу BoosterOrder"""
     try:
-        from models import BoosterOrder
-        
-        with get_session() as session:
+        async with get_async_session() as session:
             order = BoosterOrder(
                 task_id=task_id,
                 task_type=task_type,
@@ -206,7 +260,7 @@ async def save_booster_order(
                 status='pending'
             )
             session.add(order)
-            session.commit()
+            await session.commit()
             log.info(f"✅ Заказ сохранен в БД: {external_order_id} для задачи {task_type} #{task_id}")
             return True
     except Exception as e:
@@ -216,17 +270,23 @@ async def save_booster_order(
 class SubscribersTracker:
     """Трекер для отслеживания подписчиков канала в реальном времени через сырые события"""
     
-    def __init__(self, task_id: int, client: TelegramClient):
+    def __init__(self, task_id: int, client: TelegramClient,
+                 task: Optional[SubscribersBoostTask] = None, target: Optional[MainEntity] = None):
         self.task_id = task_id
         self.client = client
         self.is_running = True
-        self.current_task_data: Optional[SubscribersBoostTask] = None
-        self.current_target_data: Optional[MainEntity] = None
+        # Данные могут быть предзагружены менеджером через bulk_load
+        self.current_task_data: Optional[SubscribersBoostTask] = task
+        self.current_target_data: Optional[MainEntity] = target
+        self.channel_link: Optional[str] = None
         
+        # Число подряд неудачных проверок (для экспоненциальной задержки)
+        self.failed_checks = 0
+
         # Статистика за текущий период
         self.current_subscriptions = 0
         self.current_unsubscriptions = 0
-        self.last_check_time = datetime.now(UTC_TZ)
+        self.last_check_time = time.monotonic()  # monotonic: используется только для интервалов
         
         # Обработчики событий
         self.event_handlers = []
@@ -239,10 +299,25 @@ class SubscribersTracker:
         # Состояние для фоновой сверки
         self._last_count = None
         self._last_user_ids: set[int] = set()
-        
-        # Фоновая задача
-        self._background_task = None
     
+    @classmethod
+    def bulk_load(cls, task_ids: List[int]) -> Dict[int, tuple]:
+        """Загружает задачи вместе с каналами одним запросом: {task_id: (task, target)}"""
+        if not task_ids:
+            return {}
+        try:
+            with get_session() as session:
+                tasks = session.execute(
+                    select(SubscribersBoostTask)
+                    .options(joinedload(SubscribersBoostTask.target))
+                    .where(SubscribersBoostTask.id.in_(task_ids))
+                ).scalars().all()
+            log.info(f"✅ Загружено {len(tasks)} задач подписчиков одним запросом")
+            return {t.id: (t, t.target) for t in tasks}
+        except Exception as e:
+            log.error(f"❌ Ошибка пакетной загрузки задач подписчиков: {e}")
+            return {}
+
     def _load_task_data_from_db(self) -> tuple:
         """Загружает актуальные данные задачи из БД ВКЛЮЧАЯ last_processed_event_id"""
         try:
@@ -251,7 +326,7 @@ class SubscribersTracker:
                     select(SubscribersBoostTask)
                     .options(joinedload(SubscribersBoostTask.target))
                     .where(SubscribersBoostTask.id == self.task_id)
-                ).unique().scalar_one_or_none()
+                ).scalar_one_or_none()
                 
                 if not task_result:
                     log.error(f"❌ Задача #{self.task_id} не найдена в БД")
@@ -265,13 +340,18 @@ class SubscribersTracker:
             log.error(f"❌ Ошибка загрузки задачи подписчиков #{self.task_id}: {e}")
             return None, None
 
-    async def load_task_data(self):
-        """Загружает данные задачи"""
-        self.current_task_data, self.current_target_data = self._load_task_data_from_db()
-        
-        log.info(f"📊 Результат загрузки данных для задачи #{self.task_id}: "
-                f"task={self.current_task_data is not None}, "
-                f"target={self.current_target_data is not None}")
+    async def load_task_data(self, force: bool = False):
+        """Загружает данные задачи (если они не были предзагружены)"""
+        if force or self.current_task_data is None or self.current_target_data is None:
+            self.current_task_data, self.current_target_data = self._load_task_data_from_db()
+            
+            log.info(f"📊 Результат загрузки данных для задачи #{self.task_id}: "
+                    f"task={self.current_task_data is not None}, "
+                    f"target={self.current_target_data is not None}")
+
+        # Ссылка на канал для API считается один раз при загрузке, а не на каждой проверке
+        target = self.current_target_data
+        self.channel_link = (target.link or f"https://t.me/c/{abs(target.telegram_id)}") if target else None
         
         return self.current_task_data is not None and self.current_target_data is not None
 
@@ -318,7 +398,6 @@ class SubscribersTracker:
 
             # 🔹 Загружаем последний обработанный ID из БД
             last_processed_id = self.current_task_data.last_processed_event_id or 0
-            processed_event_ids: set[int] = set()
             
             # 🔹 Получаем все события, начиная с последнего обработанного
             try:
@@ -334,7 +413,6 @@ class SubscribersTracker:
                     new_events = [ev for ev in init_log.events if ev.id > last_processed_id]
                     if new_events:
                         max_event_id = max(ev.id for ev in new_events)
-                        processed_event_ids = {ev.id for ev in new_events}
                         
                         # 🔹 СРАЗУ ЖЕ ОБРАБАТЫВАЕМ события, которые произошли пока скрипт не работал
                         joins, leaves = await self._process_events_batch(new_events)
@@ -348,77 +426,10 @@ class SubscribersTracker:
             except Exception as e:
                 log.warning(f"⚠️ Не удалось получить начальный admin log для {self.current_target_data.name}: {e}")
 
-            last_check_time = datetime.now(UTC_TZ)
-
-            async def admin_log_checker():
-                """Периодическая проверка новых событий через getAdminLog с сохранением ID"""
-                nonlocal processed_event_ids, last_check_time
-
-                while self.is_running:
-                    try:
-                        # 🔹 ВСЕГДА запрашиваем события, начиная с последнего обработанного ID
-                        current_last_id = self.current_task_data.last_processed_event_id or 0
-                        
-                        result = await self.client(functions.channels.GetAdminLogRequest(
-                            channel=self.channel_entity,
-                            q='',
-                            min_id=current_last_id,  # 🔹 НАЧИНАЕМ С ПОСЛЕДНЕГО ОБРАБОТАННОГО
-                            max_id=0,
-                            limit=100,
-                        ))
-
-                        if result and result.events:
-                            # 🔹 Фильтруем только новые события (ID > current_last_id)
-                            new_events = [ev for ev in result.events if ev.id > current_last_id]
-                            
-                            if new_events:
-                                joins, leaves = 0, 0
-                                max_event_id = current_last_id
-                                
-                                for ev in new_events:
-                                    if ev.id > max_event_id:
-                                        max_event_id = ev.id
-                                    
-                                    action = ev.action
-                                    user_id = getattr(ev, "user_id", None)
-                                    event_time = datetime.fromtimestamp(ev.date.timestamp(), UTC_TZ)
-                                    
-                                    if isinstance(action, types.ChannelAdminLogEventActionParticipantJoin):
-                                        joins += 1
-                                        log.debug(f"🟢 JOIN user={user_id} в {self.current_target_data.name}")
-                                    elif isinstance(action, types.ChannelAdminLogEventActionParticipantLeave):
-                                        leaves += 1
-                                        log.debug(f"🔴 LEAVE user={user_id} в {self.current_target_data.name}")
-                                    elif isinstance(action, types.ChannelAdminLogEventActionParticipantInvite):
-                                        joins += 1
-                                        log.debug(f"🟣 INVITE user={user_id} в {self.current_target_data.name}")
-
-                                # 🔹 НЕМЕДЛЕННО обновляем последний обработанный ID
-                                if max_event_id > current_last_id:
-                                    await self._update_last_processed_id(max_event_id)
-
-                                if joins or leaves:
-                                    self.current_subscriptions += joins
-                                    self.current_unsubscriptions += leaves
-                                    
-                                    log.info(f"📋 [{self.current_target_data.name}] Обработано {len(new_events)} событий: +{joins}/-{leaves} (последний ID: {max_event_id})")
-                                
-                                last_check_time = datetime.now(UTC_TZ)
-                            else:
-                                log.debug(f"⏳ [{self.current_target_data.name}] Новых событий нет (последний ID: {current_last_id})")
-
-                        await asyncio.sleep(60)  # Проверяем каждую минуту
-
-                    except FloodWaitError as e:
-                        log.warning(f"⏳ FloodWait {e.seconds} сек. для {self.current_target_data.name}")
-                        await asyncio.sleep(e.seconds)
-                    except asyncio.CancelledError:
-                        break
-                    except Exception as e:
-                        log.error(f"❌ Ошибка при проверке admin log для {self.current_target_data.name}: {e}")
-                        await asyncio.sleep(120)
+            self.last_check_time = time.monotonic()
 
-            self._background_task = asyncio.create_task(admin_log_checker())
+            # 🔹 Дальнейший опрос admin log ведёт общий планировщик для всех трекеров
+            admin_log_scheduler.register(self)
             log.info(f"🎯 Admin-log мониторинг активирован для {self.current_target_data.name} (начальный ID: {last_processed_id})")
             return True
 
@@ -426,9 +437,48 @@ class SubscribersTracker:
             log.error(f"❌ Ошибка настройки admin-log обработчика: {e}")
             return False
 
+    async def check_admin_log(self):
+        """Один проход по admin log: забирает новые события и обновляет счётчики.
+        FloodWaitError пробрасывается в AdminLogScheduler."""
+        # 🔹 ВСЕГДА запрашиваем события, начиная с последнего обработанного ID
+        current_last_id = self.current_task_data.last_processed_event_id or 0
+
+        result = await self.client(functions.channels.GetAdminLogRequest(
+            channel=self.channel_entity,
+            q='',
+            min_id=current_last_id,  # 🔹 НАЧИНАЕМ С ПОСЛЕДНЕГО ОБРАБОТАННОГО
+            max_id=0,
+            limit=100,
+        ))
+
+        if not result or not result.events:
+            return
+
+        # 🔹 Фильтруем только новые события (ID > current_last_id)
+        new_events = [ev for ev in result.events if ev.id > current_last_id]
+        if not new_events:
+            log.debug("⏳ [%s] Новых событий нет (последний ID: %s)", self.current_target_data.name, current_last_id)
+            return
+
+        max_event_id = max(ev.id for ev in new_events)
+        joins, leaves = await self._process_events_batch(new_events)
+
+        # 🔹 НЕМЕДЛЕННО обновляем последний обработанный ID
+        if max_event_id > current_last_id:
+            await self._update_last_processed_id(max_event_id)
+
+        if joins or leaves:
+            self.current_subscriptions += joins
+            self.current_unsubscriptions += leaves
+
+            log.info(f"📋 [{self.current_target_data.name}] Обработано {len(new_events)} событий: +{joins}/-{leaves} (последний ID: {max_event_id})")
+
+        self.last_check_time = time.monotonic()
+
     async def _process_events_batch(self, events: list) -> tuple[int, int]:
         """Обрабатывает пачку событий и возвращает количество подписок/отписок"""
         joins, leaves = 0, 0
+        name = self.current_target_data.name if self.current_target_data else self.task_id
         
         for ev in events:
             action = ev.action
@@ -436,30 +486,33 @@ class SubscribersTracker:
             
             if isinstance(action, types.ChannelAdminLogEventActionParticipantJoin):
                 joins += 1
+                log.debug("🟢 JOIN user=%s в %s", user_id, name)
             elif isinstance(action, types.ChannelAdminLogEventActionParticipantLeave):
                 leaves += 1
+                log.debug("🔴 LEAVE user=%s в %s", user_id, name)
             elif isinstance(action, types.ChannelAdminLogEventActionParticipantInvite):
                 joins += 1
+                log.debug("🟣 INVITE user=%s в %s", user_id, name)
         
         return joins, leaves
 
     async def _update_last_processed_id(self, event_id: int):
         """Обновляет последний обработанный ID события в БД"""
         try:
-            with get_session() as session:
-                task = session.execute(
+            async with get_async_session() as session:
+                task = (await session.execute(
                     select(SubscribersBoostTask)
                     .where(SubscribersBoostTask.id == self.task_id)
-                ).scalar_one()
+                )).scalar_one()
                 
                 task.last_processed_event_id = event_id
-                session.commit()
+                await session.commit()
                 
                 # Также обновляем в текущем объекте
                 if self.current_task_data:
                     self.current_task_data.last_processed_event_id = event_id
                     
-                log.debug(f"💾 Обновлен last_processed_event_id={event_id} для задачи #{self.task_id}")
+                log.debug("💾 Обновлен last_processed_event_id=%s для задачи #%s", event_id, self.task_id)
         except Exception as e:
             log.error(f"❌ Ошибка обновления last_processed_event_id для задачи #{self.task_id}: {e}")
 
@@ -472,155 +525,29 @@ class SubscribersTracker:
             except Exception:
                 pass
         self.event_handlers.clear()
-        if hasattr(self, "_background_task") and self._background_task:
-            self._background_task.cancel()
+        admin_log_scheduler.unregister(self)
     
     async def _save_check_record(self, total_subscribers: int, new_subscriptions: int, 
                                new_unsubscriptions: int, unsubscribed_users: List[int] = None):
-        """Сохраняет запись о проверке в БД"""
-        try:
-            with get_session() as session:
-                check = SubscribersCheck(
-                    task_id=self.task_id,
-                    total_subscribers=total_subscribers,
-                    new_subscriptions=new_subscriptions,
-                    new_unsubscriptions=new_unsubscriptions,
-                    unsubscribed_users=unsubscribed_users or []
-                )
-                session.add(check)
-                session.commit()
-                log.debug(f"💾 Сохранена запись проверки: подписчиков={total_subscribers}, подписки={new_subscriptions}, отписки={new_unsubscriptions}")
-        except Exception as e:
-            log.error(f"❌ Ошибка сохранения записи проверки: {e}")
+        """Ставит запись о проверке в очередь менеджера; в БД она пишется пачкой в конце тика"""
+        manager.queue_check({
+            "task_id": self.task_id,
+            "total_subscribers": total_subscribers,
+            "new_subscriptions": new_subscriptions,
+            "new_unsubscriptions": new_unsubscriptions,
+            "unsubscribed_users": unsubscribed_users or [],
+        })
+        log.debug(f"💾 Запись проверки в очереди: подписчиков={total_subscribers}, подписки={new_subscriptions}, отписки={new_unsubscriptions}")
     
     async def _save_expense(self, subscribers_count: int, price: float, service_id: int, order_id: str = None):
-        """Сохраняет информацию о расходе на подписчиков"""
-        try:
-            with get_session() as session:
-                expense = SubscribersBoostExpense(
-                    task_id=self.task_id,
-                    subscribers_count=subscribers_count,
-                    price=price,  # <-- Убедитесь что price это float, а не tuple
-                    service_id=service_id
-                )
-                session.add(expense)
-                session.flush()  # Получаем ID расхода
-                
-                # Обновляем заказ в БД с ценой и expense_id
-                if order_id and isinstance(price, (int, float)):  # <-- Проверка типа
-                    from models import BoosterOrder
-                    from sqlalchemy import update
-                    
-                    # Находим и обновляем заказ
-                    stmt = update(BoosterOrder).where(
-                        BoosterOrder.external_order_id == order_id
-                    ).values(
-                        price=float(price),  # <-- Явное преобразование
-                        expense_id=expense.id,
-                        status='in_progress',
-                        updated_at=datetime.utcnow()
-                    )
-                    session.execute(stmt)
-                
-                session.commit()
-                log.info(f"💾 Сохранен расход на подписчиков: {subscribers_count} подписчиков, цена: {price}, order: {order_id}")
-        except Exception as e:
-            log.error(f"❌ Ошибка сохранения расхода на подписчиков: {e}")
-
-    async def process_periodic_check(self):
-        """Выполняет периодическую проверку без перезагрузки основных настроек"""
-        if not self.is_running or not self.current_task_data or not self.current_target_data:
-            log.warning(f"⚠️ Трекер не готов для проверки: is_running={self.is_running}, "
-                       f"task_data={self.current_task_data is not None}, "
-                       f"target_data={self.current_target_data is not None}")
-            return
-        
-        # Проверяем только активность задачи, не перезагружая все данные
-        if not await self.check_task_active():
-            log.info(f"🛑 Задача #{self.task_id} деактивирована в БД")
-            self.stop()
-            return
-        
-        try:
-            log.info(f"🔍 Периодическая проверка для задачи #{self.task_id}, канал: {self.current_target_data.name}")
-            
-            # Получаем текущее количество подписчиков
-            current_total = await self.get_current_subscribers_count(self.current_target_data)
-            
-            if current_total == 0:
-                log.error(f"❌ Не удалось получить подписчиков для канала {self.current_target_data.name}")
-                return
-            
-            # ВАЖНО: Сохраняем статистику за период ПЕРЕД отправкой в API
-            await self._save_check_record(current_total, self.current_subscriptions, self.current_unsubscriptions)
-            
-            # Рассчитываем количество подписчиков для отправки в API
-            subscribers_to_send = self._calculate_subscribers_to_send(self.current_unsubscriptions)
-            
-            # Отправляем запрос на API если нужно
-            if subscribers_to_send > 0:
-                log.info(f"📤 Подготовка к отправке {subscribers_to_send} подписчиков для компенсации {self.current_unsubscriptions} отписок")
-                
-                channel_link = self.current_target_data.link if self.current_target_data.link else f"https://t.me/c/{abs(self.current_target_data.telegram_id)}"
-                
-                with get_session() as session:
-                    settings = get_booster_settings(session)
-                    if not settings:
-                        log.error("❌ Не найдены глобальные настройки бустера")
-                        return
-                    
-                    if not settings.api_key:
-                        log.error("🚨 КРИТИЧЕСКАЯ ОШИБКА: API ключ пустой в настройках бустера!")
-                        return
-
-                    # ИСПОЛЬЗУЕМ НОВЫЙ МЕТОД С ПРОВЕРКОЙ ОЧЕРЕДЕЙ
-                    service_id = await BoosterServiceRotation.get_next_service_id_for_module(
-                        session=session,
-                        module_name="subscribers",
-                        tariffs=settings.tariffs,
-                        default_service_id=settings.subscribers_service_id,
-                        count=subscribers_to_send,
-                        booster_settings=settings  # Для проверки очередей
-                    )
-                    
-                    if not service_id:
-                        log.error("❌ Не найден service_id для подписчиков")
-                        return
-                    
-                    # Логируем внутри контекста сессии
-                    log.info(f"🔧 Параметры API: service_id={service_id}, channel_link={channel_link}")
-                    
-                    order_id, price = await api_send_subscribers(
-                        subscribers_count=subscribers_to_send,
-                        channel_link=channel_link,
-                        api_key=settings.api_key,
-                        service_id=service_id,
-                        task_id=self.task_id
-                    )
-                    
-                    if price > 0 and order_id:
-                        log.info(f"✅ Успешно отправлен запрос на {subscribers_to_send} подписчиков, цена: {price}, order: {order_id}")
-                        # Сохраняем расход с обновленной ценой
-                        await self._save_expense(subscribers_to_send, price, service_id, order_id)
-                        
-                        # Сбрасываем счетчик отписок после успешной отправки
-                        self.current_unsubscriptions = 0
-                    else:
-                        log.error(f"❌ Ошибка отправки запроса на подписчиков или нулевая цена")
-            else:
-                if self.current_unsubscriptions > 0:
-                    log.info(f"✅ Обнаружены отписки: {self.current_unsubscriptions}, но отправка не требуется")
-                else:
-                    log.info(f"✅ Отписок не обнаружено")
-            
-            # Сбрасываем счетчик подписок
-            self.current_subscriptions = 0
-            
-            log.info(f"✅ Периодическая проверка завершена: подписчиков={current_total}")
-            
-        except Exception as e:
-            log.error(f"❌ Ошибка периодической проверки для задачи #{self.task_id}: {e}")
-            raise  # Пробрасываем для обработки в safe_process_periodic_check
+        """Ставит расход на подписчиков в очередь менеджера; в БД он пишется пачкой в конце тика"""
+        manager.queue_expense({
+            "task_id": self.task_id,
+            "subscribers_count": subscribers_count,
+            "price": price,  # <-- Убедитесь что price это float, а не tuple
+            "service_id": service_id,
+        }, order_id)
+        log.info(f"💾 Расход на подписчиков в очереди: {subscribers_count} подписчиков, цена: {price}, order: {order_id}")
 
     def _calculate_subscribers_to_send(self, new_unsubscriptions: int) -> int:
         """Рассчитывает количество подписчиков для отправки в API с учетом лимита"""
@@ -666,7 +593,7 @@ class SubscribersTracker:
         """Восстановление после ошибок"""
         try:
             # Перезагружаем только минимально необходимые данные
-            await self.load_task_data()
+            await self.load_task_data(force=True)
             log.info(f"✅ Восстановление данных трекера #{self.task_id} выполнено")
             return True
         except Exception as e:
@@ -674,14 +601,16 @@ class SubscribersTracker:
             self.stop()
             return False
     
-    async def safe_process_periodic_check(self):
-        """Защищенная версия с восстановлением при ошибках"""
+    async def safe_process_periodic_check(self) -> bool:
+        """Защищенная версия с восстановлением при ошибках. Возвращает False, если проверка упала"""
         try:
             await self.process_periodic_check()
+            return True
         except Exception as e:
             log.error(f"❌ Критическая ошибка в проверке задачи #{self.task_id}: {e}")
             # Попытка восстановления
             await self.recover_from_error()
+            return False
     
     async def process_periodic_check(self):
         """Выполняет периодическую проверку без перезагрузки основных настроек"""
@@ -691,14 +620,15 @@ class SubscribersTracker:
                        f"target_data={self.current_target_data is not None}")
             return
         
-        # Проверяем только активность задачи, не перезагружая все данные
+        # Проверяем только активность задачи, не перезагружая все данные: деактивированная
+        # задача не должна оформлять платные заказы до следующего опроса менеджера
         if not await self.check_task_active():
             log.info(f"🛑 Задача #{self.task_id} деактивирована в БД")
             self.stop()
             return
         
         try:
-            log.info(f"🔍 Периодическая проверка для задачи #{self.task_id}, канал: {self.current_target_data.name}")
+            log.info("🔍 Периодическая проверка для задачи #%s, канал: %s", self.task_id, self.current_target_data.name)
             
             # Получаем текущее количество подписчиков
             current_total = await self.get_current_subscribers_count(self.current_target_data)
@@ -715,64 +645,59 @@ class SubscribersTracker:
             
             # Отправляем запрос на API если нужно
             if subscribers_to_send > 0:
-                log.info(f"📤 Подготовка к отправке {subscribers_to_send} подписчиков для компенсации {self.current_unsubscriptions} отписок")
+                log.info("📤 Подготовка к отправке %s подписчиков для компенсации %s отписок",
+                         subscribers_to_send, self.current_unsubscriptions)
                 
-                channel_link = self.current_target_data.link if self.current_target_data.link else f"https://t.me/c/{abs(self.current_target_data.telegram_id)}"
+                # Настройки берём из кэша менеджера (TTL), а не из БД на каждую проверку
+                settings = await manager.get_settings()
+                if not settings:
+                    log.error("❌ Не найдены глобальные настройки бустера")
+                    return
                 
-                with get_session() as session:
-                    # Получаем настройки из БД (без кэша)
-                    settings = get_booster_settings(session)
-                    if not settings:
-                        log.error("❌ Не найдены глобальные настройки бустера")
-                        return
-                    
-                    # ПРОВЕРЯЕМ КРИТИЧЕСКИЕ ПОЛЯ
-                    if not settings.api_key:
-                        log.error("🚨 КРИТИЧЕСКАЯ ОШИБКА: API ключ пустой в настройках бустера!")
-                        return
-
-                    service_id = await BoosterServiceRotation.get_next_service_id_for_module(
-                        session=session,
-                        module_name="subscribers",
-                        tariffs=settings.tariffs,
-                        default_service_id=settings.subscribers_service_id,
-                        count=subscribers_to_send,
-                        booster_settings=settings  # Для проверки очередей
-                    )
-                    if not service_id:
-                        log.error("❌ Не найден service_id для подписчиков")
-                        return
-                    
-                    # Логируем внутри контекста сессии
-                    log.info(f"🔧 Параметры API: service_id={service_id}, channel_link={channel_link}, "
-                            f"api_key={'***' + settings.api_key[-4:] if settings.api_key else '🚨 НЕТ'}")
-                    
-                    order_id, price = await api_send_subscribers(  # ← Измените на кортеж
-                        subscribers_count=subscribers_to_send,
-                        channel_link=channel_link,
-                        api_key=settings.api_key,
-                        service_id=service_id,
-                        task_id=self.task_id
-                    )
+                # ПРОВЕРЯЕМ КРИТИЧЕСКИЕ ПОЛЯ
+                if not settings.api_key:
+                    log.error("🚨 КРИТИЧЕСКАЯ ОШИБКА: API ключ пустой в настройках бустера!")
+                    return
+
+                # Ротация тарифов хранится в памяти менеджера, а не перечитывается из БД
+                service_id = await manager.next_service_id(settings, subscribers_to_send)
+                if not service_id:
+                    log.error("❌ Не найден service_id для подписчиков")
+                    return
+                
+                # Логируем параметры запроса
+                if log.isEnabledFor(logging.INFO):
+                    log.info("🔧 Параметры API: service_id=%s, channel_link=%s, api_key=***%s",
+                             service_id, self.channel_link, settings.api_key[-4:])
+                
+                order_id, price = await api_send_subscribers(  # ← Измените на кортеж
+                    http=manager.http,
+                    subscribers_count=subscribers_to_send,
+                    channel_link=self.channel_link,
+                    api_key=settings.api_key,
+                    service_id=service_id,
+                    task_id=self.task_id,
+                    price_per_1000=get_tariff_price(settings, service_id)
+                )
+                
+                if price > 0:
+                    log.info("✅ Успешно отправлен запрос на %s подписчиков, цена: %s", subscribers_to_send, price)
+                    await self._save_expense(subscribers_to_send, price, service_id)
                     
-                    if price > 0:
-                        log.info(f"✅ Успешно отправлен запрос на {subscribers_to_send} подписчиков, цена: {price}")
-                        await self._save_expense(subscribers_to_send, price, service_id)
-                        
-                        # Сбрасываем счетчик отписок после успешной отправки
-                        self.current_unsubscriptions = 0
-                    else:
-                        log.error(f"❌ Ошибка отправки запроса на подписчиков или нулевая цена")
+                    # Сбрасываем счетчик отписок после успешной отправки
+                    self.current_unsubscriptions = 0
+                else:
+                    log.error("❌ Ошибка отправки запроса на подписчиков или нулевая цена")
             else:
                 if self.current_unsubscriptions > 0:
-                    log.info(f"✅ Обнаружены отписки: {self.current_unsubscriptions}, но отправка не требуется")
+                    log.info("✅ Обнаружены отписки: %s, но отправка не требуется", self.current_unsubscriptions)
                 else:
-                    log.info(f"✅ Отписок не обнаружено")
+                    log.info("✅ Отписок не обнаружено")
             
             # Сбрасываем счетчик подписок
             self.current_subscriptions = 0
             
-            log.info(f"✅ Периодическая проверка завершена: подписчиков={current_total}")
+            log.info("✅ Периодическая проверка завершена: подписчиков=%s", current_total)
             
         except Exception as e:
             log.error(f"❌ Ошибка периодической проверки для задачи #{self.task_id}: {e}")
@@ -785,17 +710,169 @@ class SubscribersTracker:
         return DEFAULT_CHECK_INTERVAL * 60
     
 
+class AdminLogScheduler:
+    """Общий цикл опроса admin log для всех трекеров вместо отдельного таймера на каждый"""
+
+    def __init__(self, interval: int = ADMIN_LOG_POLL_INTERVAL, concurrency: int = ADMIN_LOG_CONCURRENCY):
+        self.interval = interval
+        self.concurrency = concurrency
+        self._trackers: Dict[int, SubscribersTracker] = {}
+        self._task: Optional[asyncio.Task] = None
+        # FloodWait выдаётся на аккаунт: id(client) -> time.monotonic(), до которого его трекеры пропускаем
+        self._flood_until: Dict[int, float] = {}
+
+    def register(self, tracker: SubscribersTracker):
+        """Добавляет трекер в общий цикл и запускает цикл при необходимости"""
+        self._trackers[tracker.task_id] = tracker
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, tracker: SubscribersTracker):
+        """Убирает трекер из цикла; цикл останавливается, когда трекеров не осталось"""
+        if self._trackers.get(tracker.task_id) is tracker:
+            del self._trackers[tracker.task_id]
+        if not self._trackers and self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _poll(self, tracker: SubscribersTracker, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                await tracker.check_admin_log()
+            except FloodWaitError as e:
+                # Ждёт только этот клиент; трекеры остальных ботов опрашиваются дальше
+                key = id(tracker.client)
+                until = time.monotonic() + e.seconds
+                self._flood_until[key] = max(self._flood_until.get(key, 0.0), until)
+                log.warning(f"⏳ FloodWait {e.seconds} сек. для admin log (задача #{tracker.task_id}), "
+                            f"клиент пропускает опросы до окончания ожидания")
+            except Exception as e:
+                log.error(f"❌ Ошибка при проверке admin log для задачи #{tracker.task_id}: {e}")
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while self._trackers:
+            try:
+                await asyncio.sleep(self.interval)  # Проверяем каждую минуту
+
+                now = time.monotonic()
+                self._flood_until = {k: v for k, v in self._flood_until.items() if v > now}
+                trackers = [
+                    t for t in self._trackers.values()
+                    if t.is_running and id(t.client) not in self._flood_until
+                ]
+                await asyncio.gather(
+                    *(self._poll(t, semaphore) for t in trackers),
+                    return_exceptions=True
+                )
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                log.error(f"❌ Ошибка в общем цикле admin log: {e}")
+                await asyncio.sleep(120)
+
+
+admin_log_scheduler = AdminLogScheduler()
+
+
 class SubscribersBoostManager:
     """Менеджер для управления всеми задачами отслеживания подписчиков"""
     
     def __init__(self):
         self.trackers: Dict[int, SubscribersTracker] = {}
         self.clients: Dict[int, TelegramClient] = {}
-        self.periodic_tasks: Dict[int, asyncio.Task] = {}
+
+        # Общий планировщик периодических проверок: куча (срок, порядковый номер, трекер)
+        self._schedule: List[Tuple[float, int, SubscribersTracker]] = []
+        self._schedule_seq = itertools.count()
+        self._scheduler_task: Optional[asyncio.Task] = None
+        self._pending_checks: List[dict] = []
+        self._pending_expenses: List[Tuple[dict, Optional[str]]] = []
+
+        # Кэш глобальных настроек бустера: (время загрузки по monotonic, настройки)
+        self._settings_cache: Optional[Tuple[float, BoosterSettings]] = None
+        self._settings_lock = asyncio.Lock()
+
+        # Состояние ротации тарифов в памяти; в БД пишется вместе с остальными данными тика
+        self._rotation: Optional[BoosterServiceRotation] = None
+        self._rotation_lock = asyncio.Lock()
+        self._rotation_dirty = False
+        # Растёт при каждом изменении ротации: flush() снимает dirty, только если с момента снимка изменений не было
+        self._rotation_version = 0
+        # Ставится слушателем pg_notify при изменениях в БД
+        self.db_changed_event = asyncio.Event()
+        self._updates_lock = asyncio.Lock()
+        # Общая HTTP-сессия для запросов к API бустера (создаётся в initialize)
+        self.http: Optional[aiohttp.ClientSession] = None
         
+    async def get_settings(self) -> Optional[BoosterSettings]:
+        """Возвращает настройки бустера из кэша, перечитывая их из БД не чаще раза в SETTINGS_TTL"""
+        cached = self._settings_cache
+        if cached and time.monotonic() - cached[0] < SETTINGS_TTL:
+            return cached[1]
+
+        async with self._settings_lock:
+            # Пока ждали блокировку, настройки мог обновить другой трекер
+            cached = self._settings_cache
+            if cached and time.monotonic() - cached[0] < SETTINGS_TTL:
+                return cached[1]
+
+            with get_session() as session:
+                settings = get_booster_settings(session)
+            if settings:
+                self._settings_cache = (time.monotonic(), settings)
+            return settings
+
+    async def invalidate_settings(self):
+        """Сбрасывает кэш настроек бустера и ротации (по уведомлению tasks_changed об изменениях задач)"""
+        self._settings_cache = None
+        # Несохранённое состояние ротации дописывает асинхронный flush() — без синхронной записи в цикле событий
+        if self._rotation_dirty:
+            await self.flush()
+        # next_service_id держит ротацию под _rotation_lock во время await — сбрасываем её под тем же локом;
+        # если запись не удалась, dirty остаётся выставленным и объект живёт в памяти до следующего flush()
+        async with self._rotation_lock:
+            if not self._rotation_dirty:
+                self._rotation = None
+
+    async def next_service_id(self, settings: BoosterSettings, count: int) -> int:
+        """Выбирает service_id через общий объект ротации, который живёт в памяти менеджера"""
+        async with self._rotation_lock:
+            if self._rotation is None:
+                with get_session() as session:
+                    self._rotation = BoosterServiceRotation.get_or_create_rotation(
+                        session, "subscribers", settings.subscribers_service_id
+                    )
+
+            with get_session() as session:
+                # Сессия нужна только для проверки очередей заказов (BoosterOrder)
+                service_id = await self._rotation.get_next_service_id(
+                    session, settings.tariffs, count, settings
+                )
+
+            # Состояние ротации пишется в flush() той же транзакцией, что и проверки тика
+            self._rotation_dirty = True
+            self._rotation_version += 1
+            return service_id
+
+    async def handle_db_changes(self):
+        """Сбрасывает кэши и синхронизирует трекеры по уведомлениям об изменениях в БД"""
+        while True:
+            await self.db_changed_event.wait()
+            self.db_changed_event.clear()
+            log.info("🔔 Обнаружены изменения в БД, сбрасываю кэш настроек и проверяю задачи")
+            await self.invalidate_settings()
+            try:
+                await self.check_for_updates()
+            except Exception as e:
+                log.error(f"❌ Ошибка при проверке обновлений БД по уведомлению: {e}")
+
     async def initialize(self):
         """Инициализация менеджера"""
         log.info("🔄 Инициализация менеджера отслеживания подписчиков...")
+        if self.http is None or self.http.closed:
+            self.http = create_http_session()
         await self._load_tasks()
         
     async def _load_tasks(self):
@@ -803,9 +880,9 @@ class SubscribersBoostManager:
         with get_session() as session:
             tasks_result = session.execute(
                 select(SubscribersBoostTask)
-                .options(joinedload(SubscribersBoostTask.target), joinedload(SubscribersBoostTask.bot))
+                .options(selectinload(SubscribersBoostTask.target), selectinload(SubscribersBoostTask.bot))
                 .where(SubscribersBoostTask.is_active == True)
-            ).unique().scalars().all()
+            ).scalars().all()
         
         if not tasks_result:
             log.info("🔍 Нет активных задач отслеживания подписчиков")
@@ -813,98 +890,271 @@ class SubscribersBoostManager:
         
         log.info(f"🔍 Загружено {len(tasks_result)} активных задач подписчиков")
         
-        bot_ids = sorted(set(t.bot_id for t in tasks_result))
+        # Боты уже подгружены через selectinload(bot) — второй запрос не нужен
+        bots = {t.bot_id: t.bot for t in tasks_result if t.bot}
+        bot_ids = sorted(bots)
         
-        with get_session() as session:
-            bots = {b.id: b for b in session.execute(select(BotSession).where(BotSession.id.in_(bot_ids))).scalars().all()}
-        
-        # Инициализация клиентов
-        for bot_id in bot_ids:
-            if bot_id not in self.clients:
-                try:
-                    client = init_user_client(bots[bot_id])
-                    await client.start()
-                    if not await client.is_user_authorized():
-                        raise RuntimeError(f"Бот #{bot_id} не авторизован")
-                    self.clients[bot_id] = client
-                    log.info(f"✅ Бот #{bot_id} авторизован для отслеживания подписчиков")
-                except Exception as e:
-                    log.error(f"❌ Ошибка инициализации бота #{bot_id}: {e}")
+        # Инициализация клиентов (параллельно: подключения к разным ботам независимы)
+        pending_bot_ids = [bot_id for bot_id in bot_ids if bot_id not in self.clients]
+        results = await asyncio.gather(
+            *(self._init_client(bots[bot_id]) for bot_id in pending_bot_ids),
+            return_exceptions=True
+        )
+        for bot_id, result in zip(pending_bot_ids, results):
+            if isinstance(result, Exception):
+                log.error(f"❌ Ошибка инициализации бота #{bot_id}: {result}")
+            else:
+                self.clients[bot_id] = result
+                log.info(f"✅ Бот #{bot_id} авторизован для отслеживания подписчиков")
         
-        # Создание и настройка трекеров
-        for task in tasks_result:
-            client = self.clients.get(task.bot_id)
-            if client and task.id not in self.trackers:
-                tracker = SubscribersTracker(task.id, client)
-                if await tracker.load_task_data():
-                    if await tracker.setup_event_handler():
-                        self.trackers[task.id] = tracker
-                        self._start_periodic_check(task.id, tracker)
-                        log.info(f"✅ Трекер подписчиков создан для задачи #{task.id}")
-                    else:
-                        log.error(f"❌ Не удалось настроить обработчик событий для задачи #{task.id}")
+        # Создание и настройка трекеров (задачи и каналы уже загружены одним запросом выше)
+        await asyncio.gather(*(self._setup_tracker(task) for task in tasks_result))
+
+    async def _init_client(self, bot: BotSession) -> TelegramClient:
+        """Подключает и проверяет авторизацию клиента одного бота"""
+        client = init_user_client(bot)
+        await client.start()
+        if not await client.is_user_authorized():
+            raise RuntimeError(f"Бот #{bot.id} не авторизован")
+        return client
+
+    async def _setup_tracker(self, task: SubscribersBoostTask):
+        """Создаёт и запускает трекер для предзагруженной задачи"""
+        client = self.clients.get(task.bot_id)
+        if not client or task.id in self.trackers:
+            return
+        try:
+            tracker = SubscribersTracker(task.id, client, task=task, target=task.target)
+            if await tracker.load_task_data():
+                if await tracker.setup_event_handler():
+                    self.trackers[task.id] = tracker
+                    self._start_periodic_check(task.id, tracker)
+                    log.info(f"✅ Трекер подписчиков создан для задачи #{task.id}")
                 else:
-                    log.error(f"❌ Не удалось загрузить данные для задачи #{task.id}")
+                    log.error(f"❌ Не удалось настроить обработчик событий для задачи #{task.id}")
+            else:
+                log.error(f"❌ Не удалось загрузить данные для задачи #{task.id}")
+        except Exception as e:
+            log.error(f"❌ Ошибка создания трекера для задачи #{task.id}: {e}")
 
     def _start_periodic_check(self, task_id: int, tracker: SubscribersTracker):
-        async def periodic_check():
-            check_interval = tracker.get_check_interval()
-            log.info(f"⏰ Установлен интервал проверки для задачи #{task_id}: {check_interval} секунд")
-            
-            while tracker.is_running:
-                try:
-                    # ЖДЕМ ПЕРЕД проверкой, а не после
-                    await asyncio.sleep(check_interval)
-                    await tracker.safe_process_periodic_check()
-                except Exception as e:
-                    log.error(f"❌ Ошибка в периодической проверке задачи #{task_id}: {e}")
-                    await asyncio.sleep(60)
-        task = asyncio.create_task(periodic_check())
-        self.periodic_tasks[task_id] = task
-
-    async def check_for_updates(self):
-        """Проверяет обновления в БД и обновляет трекеры"""
+        """Ставит трекер в общий планировщик (первая проверка — через интервал, а не сразу)"""
+        check_interval = tracker.get_check_interval()
+        log.info(f"⏰ Установлен интервал проверки для задачи #{task_id}: {check_interval} секунд")
+        self._push_schedule(tracker, time.monotonic() + check_interval)
+
+        if self._scheduler_task is None or self._scheduler_task.done():
+            self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+
+    def _push_schedule(self, tracker: SubscribersTracker, due: float):
+        heapq.heappush(self._schedule, (due, next(self._schedule_seq), tracker))
+
+    def _is_current(self, tracker: SubscribersTracker) -> bool:
+        """Трекер всё ещё активен и не заменён новым экземпляром для той же задачи"""
+        return tracker.is_running and self.trackers.get(tracker.task_id) is tracker
+
+    async def _run_check(self, tracker: SubscribersTracker, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                ok = await tracker.safe_process_periodic_check()
+            except Exception as e:
+                log.error(f"❌ Ошибка в периодической проверке задачи #{tracker.task_id}: {e}")
+                ok = False
+            tracker.failed_checks = 0 if ok else tracker.failed_checks + 1
+
+    def _next_due(self, tracker: SubscribersTracker) -> float:
+        """Следующий срок: обычный интервал или, после ошибок, задержка с джиттером"""
+        if tracker.failed_checks:
+            delay = backoff_delay(tracker.failed_checks - 1)
+            log.info(f"⏳ Повтор проверки задачи #{tracker.task_id} через {delay:.0f} сек. (ошибок подряд: {tracker.failed_checks})")
+            return time.monotonic() + delay
+        return time.monotonic() + tracker.get_check_interval()
+
+    async def _scheduler_loop(self):
+        """Один цикл на все трекеры: за тик запускает все проверки, чей срок наступил"""
+        semaphore = asyncio.Semaphore(PERIODIC_CHECK_CONCURRENCY)
+        while True:
+            try:
+                now = time.monotonic()
+                due: List[SubscribersTracker] = []
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, _, tracker = heapq.heappop(self._schedule)
+                    # Остановленные и заменённые трекеры просто выпадают из кучи
+                    if self._is_current(tracker):
+                        due.append(tracker)
+
+                if due:
+                    await asyncio.gather(*(self._run_check(t, semaphore) for t in due))
+                    await self.flush()
+                    for tracker in due:
+                        if self._is_current(tracker):
+                            self._push_schedule(tracker, self._next_due(tracker))
+
+                # Спим до ближайшего срока, но не дольше тика, чтобы подхватывать новые трекеры
+                delay = self._schedule[0][0] - time.monotonic() if self._schedule else SCHEDULER_TICK
+                await asyncio.sleep(max(0.0, min(delay, SCHEDULER_TICK)))
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                log.error(f"❌ Ошибка в планировщике периодических проверок: {e}")
+                await asyncio.sleep(SCHEDULER_TICK)
+
+    def queue_check(self, row: dict):
+        """Добавляет запись SubscribersCheck в очередь на пакетную вставку"""
+        self._pending_checks.append(row)
+
+    def queue_expense(self, row: dict, order_id: Optional[str] = None):
+        """Добавляет расход SubscribersBoostExpense (и связанный заказ) в очередь на пакетную вставку"""
+        self._pending_expenses.append((row, order_id))
+
+    async def flush(self):
+        """Пишет всё состояние тика одной транзакцией: проверки, расходы, заказы и ротацию тарифов"""
+        # Снимок ротации под локом: dirty остаётся выставленным до успешного коммита,
+        # поэтому invalidate_settings() не выбросит несохранённый объект, пока идёт запись
+        async with self._rotation_lock:
+            rotation = self._rotation if self._rotation_dirty and self._rotation and self._rotation.id else None
+            version = self._rotation_version
+        if not self._pending_checks and not self._pending_expenses and rotation is None:
+            return
+        checks, self._pending_checks = self._pending_checks, []
+        expenses, self._pending_expenses = self._pending_expenses, []
+        try:
+            await self._write_tick(rotation, checks, expenses)
+            rotation_saved = True
+            log.debug(f"💾 Сохранено записей проверок: {len(checks)}, расходов: {len(expenses)}")
+        except Exception as e:
+            # Расходы — по уже оплаченным заказам: не теряем всю пачку из-за одной строки
+            log.warning(f"⚠️ Ошибка пакетного сохранения проверок/расходов, пишем по одной: {e}")
+            rotation_saved = await self._write_rows_one_by_one(rotation, checks, expenses)
+
+        if rotation is not None and rotation_saved:
+            async with self._rotation_lock:
+                if self._rotation_version == version:
+                    self._rotation_dirty = False
+
+    async def _write_rows_one_by_one(self, rotation, checks: List[dict],
+                                     expenses: List[Tuple[dict, Optional[str]]]) -> bool:
+        """Пишет каждую запись отдельной транзакцией; возвращает False, если не сохранилась ротация"""
+        rotation_saved = True
+        if rotation is not None:
+            try:
+                await self._write_tick(rotation, [], [])
+            except Exception as e:
+                rotation_saved = False
+                log.error(f"❌ Ошибка сохранения состояния ротации: {e}")
+        for row in checks:
+            try:
+                await self._write_tick(None, [row], [])
+            except Exception as e:
+                log.error(f"❌ Не удалось сохранить проверку задачи #{row.get('task_id')}: {e}")
+        for row, order_id in expenses:
+            try:
+                await self._write_tick(None, [], [(row, order_id)])
+            except Exception as e:
+                log.error(f"❌ Не удалось сохранить расход по заказу {order_id} (задача #{row.get('task_id')}, "
+                          f"{row.get('subscribers_count')} подписчиков, цена {row.get('price')}): {e}")
+        return rotation_saved
+
+    async def _write_tick(self, rotation, checks: List[dict], expenses: List[Tuple[dict, Optional[str]]]):
+        """Одна транзакция: ротация, проверки, расходы и обновление связанных заказов"""
+        async with get_async_session() as session, session.begin():
+            if rotation is not None:
+                await session.merge(rotation)
+
+            if checks:
+                await session.execute(insert(SubscribersCheck), checks)
+
+            if expenses:
+                # ID расходов получаем из INSERT ... RETURNING в порядке переданных строк
+                expense_ids = (await session.execute(
+                    insert(SubscribersBoostExpense).returning(
+                        SubscribersBoostExpense.id, sort_by_parameter_order=True
+                    ),
+                    [row for row, _ in expenses]
+                )).scalars().all()
+
+                # Обновляем заказы с ценой и expense_id той же транзакцией
+                now = datetime.utcnow()
+                order_updates = [
+                    {"b_order_id": order_id, "b_price": float(row["price"]), "b_expense_id": expense_id, "b_now": now}
+                    for (row, order_id), expense_id in zip(expenses, expense_ids)
+                    if order_id and isinstance(row["price"], (int, float))  # <-- Проверка типа
+                ]
+                if order_updates:
+                    orders = BoosterOrder.__table__
+                    await session.execute(
+                        update(orders)
+                        .where(orders.c.external_order_id == bindparam("b_order_id"))
+                        .values(
+                            price=bindparam("b_price"),
+                            expense_id=bindparam("b_expense_id"),
+                            status='in_progress',
+                            updated_at=bindparam("b_now"),
+                        ),
+                        order_updates
+                    )
+
+    async def check_for_updates(self) -> bool:
+        """Проверяет обновления в БД и обновляет трекеры; возвращает True, если набор задач изменился"""
+        # Вызывается и из основного цикла, и по pg_notify — не даём проходам пересекаться
+        async with self._updates_lock:
+            return await self._sync_trackers()
+
+    async def _sync_trackers(self) -> bool:
+        """Сверяет трекеры с активными задачами в БД"""
+        # На каждом проходе читаем только id; полные строки — лишь для новых задач
         with get_session() as session:
-            active_tasks = session.execute(select(SubscribersBoostTask).where(SubscribersBoostTask.is_active == True)).scalars().all()
-            active_task_ids = {t.id for t in active_tasks}
-            current_tracker_ids = set(self.trackers.keys())
-            
-            # Удаляем неактивные трекеры
-            for task_id in current_tracker_ids - active_task_ids:
-                if task_id in self.trackers:
-                    self.trackers[task_id].stop()
-                    if task_id in self.periodic_tasks:
-                        self.periodic_tasks[task_id].cancel()
-                        del self.periodic_tasks[task_id]
-                    del self.trackers[task_id]
-                    log.info(f"🗑️ Удален трекер подписчиков для задачи #{task_id}")
-            
-            # Добавляем новые трекеры
-            for task in active_tasks:
-                if task.id not in self.trackers:
-                    client = self.clients.get(task.bot_id)
-                    if client:
-                        tracker = SubscribersTracker(task.id, client)
-                        if await tracker.load_task_data():
-                            if await tracker.setup_event_handler():
-                                self.trackers[task.id] = tracker
-                                self._start_periodic_check(task.id, tracker)
-                                log.info(f"✅ Добавлен трекер подписчиков для задачи #{task.id}")
+            active_task_ids = set(session.execute(
+                select(SubscribersBoostTask.id).where(SubscribersBoostTask.is_active == True)
+            ).scalars().all())
+        current_tracker_ids = set(self.trackers.keys())
+        removed_task_ids = current_tracker_ids - active_task_ids
+        
+        # Удаляем неактивные трекеры
+        for task_id in removed_task_ids:
+            if task_id in self.trackers:
+                self.trackers[task_id].stop()
+                del self.trackers[task_id]
+                log.info(f"🗑️ Удален трекер подписчиков для задачи #{task_id}")
+        
+        # Добавляем новые трекеры
+        new_task_ids = active_task_ids - current_tracker_ids
+        if not new_task_ids:
+            return bool(removed_task_ids)
+        preloaded = SubscribersTracker.bulk_load(sorted(new_task_ids))
+        await asyncio.gather(*(self._setup_tracker(task) for task, _ in preloaded.values()))
+        return True
     
+    @staticmethod
+    async def _safe_disconnect(client: TelegramClient):
+        """Отключает клиента, игнорируя ошибки соединения"""
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
     async def cleanup(self):
         """Очистка ресурсов"""
         for tracker in self.trackers.values():
             tracker.stop()
-        for task in self.periodic_tasks.values():
-            task.cancel()
-        for client in self.clients.values():
-            try:
-                await client.disconnect()
-            except Exception:
-                pass
+        if self._scheduler_task:
+            self._scheduler_task.cancel()
+            # Дожидаемся фактической отмены, чтобы планировщик не писал в БД после flush
+            await asyncio.gather(self._scheduler_task, return_exceptions=True)
+            self._scheduler_task = None
+        await self.flush()
+        # Отключаем клиентов параллельно, а не по одному
+        await asyncio.gather(
+            *(self._safe_disconnect(client) for client in self.clients.values()),
+            return_exceptions=True
+        )
+        if self.http and not self.http.closed:
+            await self.http.close()
+        self.http = None
         self.trackers.clear()
         self.clients.clear()
-        self.periodic_tasks.clear()
+        self._schedule.clear()
 
 # Глобальный менеджер
 manager = SubscribersBoostManager()
@@ -912,23 +1162,41 @@ manager = SubscribersBoostManager()
 async def run_subscribers_booster():
     """Запуск основного цикла отслеживания подписчиков"""
     log.info("🚀 Модуль отслеживания подписчиков запускается...")
+    background: List[asyncio.Task] = []
     
     try:
         await manager.initialize()
         log.info("✅ Модуль отслеживания подписчиков успешно запущен")
+
+        # Слушатель pg_notify для сброса кэшей при изменениях из админки
+        background += [
+            asyncio.create_task(listen_tasks_changed(manager.db_changed_event)),
+            asyncio.create_task(manager.handle_db_changes()),
+        ]
         
-        # Основной цикл для проверки обновлений БД
+        # Основной цикл для проверки обновлений БД: без изменений интервал растёт
+        attempt = 0
+        idle_interval = UPDATES_MIN_INTERVAL
         while True:
             try:
-                await asyncio.sleep(300)
-                await manager.check_for_updates()
+                await asyncio.sleep(idle_interval)
+                changed = await manager.check_for_updates()
+                if changed:
+                    idle_interval = UPDATES_MIN_INTERVAL
+                else:
+                    idle_interval = min(idle_interval * 1.5, UPDATES_MAX_INTERVAL)
+                attempt = 0
             except Exception as e:
-                log.error(f"❌ Ошибка при проверке обновлений БД: {e}")
-                await asyncio.sleep(60)
+                delay = backoff_delay(attempt)
+                attempt += 1
+                log.error(f"❌ Ошибка при проверке обновлений БД: {e}; повтор через {delay:.0f} сек.")
+                await asyncio.sleep(delay)
             
     except Exception as e:
         log.error(f"💥 Критическая ошибка в модуле отслеживания подписчиков: {e}")
     finally:
+        for task in background:
+            task.cancel()
         await manager.cleanup()
         log.info("🛑 Модуль отслеживания подписчиков остановлен")
 
@@ -1,13 +1,15 @@
 import asyncio
 import random
 import copy
+import time
+import weakref
+from collections import defaultdict
 from dataclasses import dataclass
+from operator import attrgetter
 from typing import List, Optional, Tuple
-from datetime import datetime, timedelta
 from telethon import types, utils
 from telethon.tl.custom.message import Message
 from telethon.tl.types import MessageMediaEmpty
-import pytz
 import re
 
 
@@ -15,13 +17,40 @@ import re
 MAX_TEXT_LEN = 4096
 MAX_CAPTION_LEN = 2048
 
+# Кэш get_entity: client -> {peer_id: (entity, ts)}; при сборке клиента его записи уходят вместе с ним
+_ENTITY_CACHE: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+ENTITY_TTL_SEC = 300
+
 LINK_RE = re.compile(r"(?:https?://)?t\.me/(?:c/)?([^/]+)/(\d+)")
 
+# Фоллбэк-разбор markdown в _parse_formatted_text: порядок альтернатив = приоритет маркеров.
+# Повторяет прежний ручной разбор: маркер закрывается ближайшим таким же (пустой текст допустим),
+# а незакрытый "**" уходит в текст как есть и не читается как курсив
+_MD_RE = re.compile(
+    r"\*\*(?P<bold>.*?)\*\*"
+    r"|__(?P<underline>.*?)__"
+    r"|(?!\*\*)\*(?P<italic>.*?)\*"
+    r"|~~(?P<strike>.*?)~~"
+    r"|`(?P<code>.*?)`",
+    re.DOTALL,
+)
+_MD_ENTITIES = {
+    "bold": types.MessageEntityBold,
+    "underline": types.MessageEntityUnderline,
+    "italic": types.MessageEntityItalic,
+    "strike": types.MessageEntityStrike,
+    "code": types.MessageEntityCode,
+}
+_MD_MARKERS = "*_~`"
+
+# Ключ хронологической сортировки сообщений и постов
+_DATE_ID = attrgetter("date", "id")
+
 
 # -----------------------------------------------------------------------------
 #   Модель «собранного» поста (одиночный пост или альбом)
 # -----------------------------------------------------------------------------
-@dataclass
+@dataclass(slots=True)
 class BuiltPost:
     """Единица публикации: одиночное сообщение или альбом (группа сообщений)."""
     messages: List[Message]
@@ -40,14 +69,64 @@ class BuiltPost:
 #   Вспомогательные функции
 # -----------------------------------------------------------------------------
 
+async def _resolve(client, peer_id: int, ttl: int = ENTITY_TTL_SEC):
+    """client.get_entity с TTL-кэшем на клиента (access_hash у каждого аккаунта свой)."""
+    now = time.time()
+    per_client = _ENTITY_CACHE.setdefault(client, {})
+    cached = per_client.get(peer_id)
+    if cached and now - cached[1] < ttl:
+        return cached[0]
+    entity = await client.get_entity(peer_id)
+    per_client[peer_id] = (entity, now)
+    return entity
+
+def _utf16(s: str) -> bytes:
+    """UTF-16-LE буфер: каждый код-юнит Telegram — ровно 2 байта."""
+    return s.encode("utf-16-le", "surrogatepass")
+
+def _from_utf16(buf: bytes) -> str:
+    # errors="ignore" отбрасывает половинку суррогатной пары, если срез пришёлся на эмодзи
+    return buf.decode("utf-16-le", "ignore")
+
 def _len16(s: str) -> int:
-    return len(utils.add_surrogate(s or ""))
+    s = s or ""
+    return len(s) if s.isascii() else len(_utf16(s)) // 2
 
 def _slice16(s: str, n16: int) -> str:
     """Обрезать строку по длине в UTF-16 код-юнитах, не ломая эмодзи."""
-    s16 = utils.add_surrogate(s or "")
-    cut16 = s16[:max(0, n16)]
-    return utils.del_surrogate(cut16)
+    s = s or ""
+    n16 = max(0, n16)
+    if s.isascii():
+        return s[:n16]
+    return _from_utf16(_utf16(s)[:2 * n16])
+
+def _fallback_clone(offset: int, length: int, e):
+    ne = copy.copy(e)
+    ne.offset = offset
+    ne.length = length
+    return ne
+
+# Прямые конструкторы для частых типов entity: быстрее, чем copy.copy
+_ENTITY_CTORS = {
+    cls: (lambda o, l, e, cls=cls: cls(o, l))
+    for cls in (
+        types.MessageEntityBold, types.MessageEntityItalic, types.MessageEntityUnderline,
+        types.MessageEntityStrike, types.MessageEntityCode, types.MessageEntitySpoiler,
+        types.MessageEntityUrl, types.MessageEntityEmail, types.MessageEntityMention,
+        types.MessageEntityHashtag, types.MessageEntityCashtag, types.MessageEntityBotCommand,
+        types.MessageEntityPhone, types.MessageEntityBankCard,
+    )
+}
+_ENTITY_CTORS.update({
+    types.MessageEntityTextUrl: lambda o, l, e: types.MessageEntityTextUrl(o, l, e.url),
+    types.MessageEntityPre: lambda o, l, e: types.MessageEntityPre(o, l, e.language),
+    types.MessageEntityMentionName: lambda o, l, e: types.MessageEntityMentionName(o, l, e.user_id),
+    types.MessageEntityCustomEmoji: lambda o, l, e: types.MessageEntityCustomEmoji(o, l, e.document_id),
+})
+
+def _clone_entity(e, offset: int, length: int):
+    """Копия entity с новыми offset/length (все доп. поля сохраняются)."""
+    return _ENTITY_CTORS.get(type(e), _fallback_clone)(offset, length, e)
 
 def _trim_entities_to_len16(entities, max_len16: int):
     """Обрезает entities, чтобы не выходили за границы текста (в UTF-16)."""
@@ -55,54 +134,31 @@ def _trim_entities_to_len16(entities, max_len16: int):
         return None
     out = []
     for e in entities:
-        start = int(getattr(e, "offset", 0))
-        length = int(getattr(e, "length", 0))
-        if start >= max_len16 or length <= 0:
+        start = e.offset
+        end = start + e.length
+        if start >= max_len16 or end <= start:
             continue
-        if start + length > max_len16:
-            length = max_len16 - start
-            if length <= 0:
-                continue
-
-        # --- создаём новый entity корректно ---
-        if isinstance(e, types.MessageEntityCustomEmoji):
-            ne = types.MessageEntityCustomEmoji(start, length, getattr(e, "document_id"))
-        else:
-            try:
-                ne = e.__class__(start, length)
-            except Exception:
-                # fallback для редких типов
-                ne = copy.copy(e)
-                ne.offset = start
-                ne.length = length
-
-        # переносим все дополнительные поля (url, language, user_id, document_id и т.п.)
-        for attr in ("url", "language", "user_id", "document_id", "custom_emoji_id"):
-            if hasattr(e, attr) and not hasattr(ne, attr):
-                setattr(ne, attr, getattr(e, attr))
-
-        out.append(ne)
+        if end > max_len16:
+            e = _clone_entity(e, start, max_len16 - start)
+        out.append(e)
     return out or None
 
 
 def _group_messages_for_posts(msgs: List[Message]) -> List[BuiltPost]:
     """Группирует сообщения в посты/альбомы."""
-    albums = {}
-    singles = []
+    albums = defaultdict(list)
+    posts: List[BuiltPost] = []
     for m in msgs:
-        gid = getattr(m, "grouped_id", None)
+        gid = m.grouped_id
         if gid:
-            albums.setdefault(gid, []).append(m)
+            albums[gid].append(m)
         else:
-            singles.append(m)
+            posts.append(BuiltPost(messages=[m]))
 
-    posts: List[BuiltPost] = []
-    for _, lst in albums.items():
-        lst_sorted = sorted(lst, key=lambda x: (x.date, x.id))
-        posts.append(BuiltPost(messages=lst_sorted))
-    for s in singles:
-        posts.append(BuiltPost(messages=[s]))
-    posts.sort(key=lambda p: (p.first.date, p.first.id))
+    for lst in albums.values():
+        lst.sort(key=_DATE_ID)
+        posts.append(BuiltPost(messages=lst))
+    posts.sort(key=lambda p: _DATE_ID(p.first))
     return posts
 
 
@@ -133,62 +189,29 @@ def _parse_formatted_text(text: str, formatting_mode: str = "markdown"):
         except Exception:
             pass
 
-        # Фоллбэк: простая ручная обработка
+        # Фоллбэк: разбор одним предкомпилированным регэкспом
+        if not any(c in text for c in _MD_MARKERS):
+            return text, None
+
+        parts = []
         entities = []
-        clean_text = ""
-        i = 0
-        while i < len(text):
-            if text.startswith("**", i):
-                end = text.find("**", i + 2)
-                if end != -1:
-                    start_offset = len(clean_text)
-                    inner = text[i + 2:end]
-                    clean_text += inner
-                    entities.append(types.MessageEntityBold(start_offset, len(inner)))
-                    i = end + 2
-                    continue
-            elif text.startswith("__", i):
-                end = text.find("__", i + 2)
-                if end != -1:
-                    start_offset = len(clean_text)
-                    inner = text[i + 2:end]
-                    clean_text += inner
-                    entities.append(types.MessageEntityUnderline(start_offset, len(inner)))
-                    i = end + 2
-                    continue
-            elif text.startswith("*", i):
-                end = text.find("*", i + 1)
-                if end != -1:
-                    start_offset = len(clean_text)
-                    inner = text[i + 1:end]
-                    clean_text += inner
-                    entities.append(types.MessageEntityItalic(start_offset, len(inner)))
-                    i = end + 1
-                    continue
-            elif text.startswith("~~", i):
-                end = text.find("~~", i + 2)
-                if end != -1:
-                    start_offset = len(clean_text)
-                    inner = text[i + 2:end]
-                    clean_text += inner
-                    entities.append(types.MessageEntityStrike(start_offset, len(inner)))
-                    i = end + 2
-                    continue
-            elif text.startswith("`", i):
-                end = text.find("`", i + 1)
-                if end != -1:
-                    start_offset = len(clean_text)
-                    inner = text[i + 1:end]
-                    clean_text += inner
-                    entities.append(types.MessageEntityCode(start_offset, len(inner)))
-                    i = end + 1
-                    continue
-
-            # по умолчанию
-            clean_text += text[i]
-            i += 1
-
-        return clean_text, entities or None
+        offset16 = 0
+        last = 0
+        for m in _MD_RE.finditer(text):
+            plain = text[last:m.start()]
+            if plain:
+                parts.append(plain)
+                offset16 += _len16(plain)
+            kind = m.lastgroup
+            inner = m.group(kind)
+            length16 = _len16(inner)
+            entities.append(_MD_ENTITIES[kind](offset16, length16))
+            parts.append(inner)
+            offset16 += length16
+            last = m.end()
+        parts.append(text[last:])
+
+        return "".join(parts), entities or None
 
     # fallback для plain-текста
     return text, None
@@ -209,48 +232,32 @@ def _append_formatted_suffix(
     # Парсим суффикс с форматированием
     suffix_text, suffix_entities = _parse_formatted_text(suffix)
 
-    sep = "\n" if base else ""
+    # Разделитель — ASCII, его длина в UTF-16 известна заранее
+    sep, sep_len16 = ("\n", 1) if base else ("", 0)
     limit = MAX_CAPTION_LEN if is_caption else MAX_TEXT_LEN
 
-    # Формируем итоговый текст
-    out_text = f"{base}{sep}{suffix_text}" if base else suffix_text
-
-    # Рассчитываем длины в UTF-16
-    base_utf16 = utils.add_surrogate(base)
-    sep_utf16 = utils.add_surrogate(sep)
-    suffix_utf16 = utils.add_surrogate(suffix_text)
-    out_utf16 = utils.add_surrogate(out_text)
-
-    base_len16 = len(base_utf16)
-    sep_len16 = len(sep_utf16)
-    suffix_len16 = len(suffix_utf16)
-    out_len16 = len(out_utf16)
-
-    # Проверяем длину и обрезаем если нужно
-    if out_len16 > limit:
-        # Вычисляем доступное место для суффикса в UTF-16
-        base_with_sep_utf16 = base_utf16 + sep_utf16
-        base_with_sep_len16 = len(base_with_sep_utf16)
-        available_len16 = limit - base_with_sep_len16
-        
-        if available_len16 > 0:
-            # Обрезаем суффикс в UTF-16
-            suffix_utf16 = suffix_utf16[:available_len16]
-            suffix_text = utils.del_surrogate(suffix_utf16)
+    # Быстрый путь: для ASCII длина в UTF-16 равна len(), перекодировать нечего
+    if base.isascii() and suffix_text.isascii() and len(base) + sep_len16 + len(suffix_text) <= limit:
+        out_text = f"{base}{sep}{suffix_text}"
+        base_len16 = len(base)
+    else:
+        # Длины в UTF-16: для ASCII-частей это len(), кодируются только остальные
+        base_len16 = _len16(base)
+        available_len16 = limit - base_len16 - sep_len16
+
+        # Проверяем длину и обрезаем если нужно
+        if _len16(suffix_text) > available_len16:
+            if available_len16 > 0:
+                # Обрезаем суффикс в UTF-16 (граница всегда чётная — по код-юнитам)
+                suffix_text = _slice16(suffix_text, available_len16)
             
-            # Обрезаем entities суффикса
-            if suffix_entities:
-                suffix_entities = [e for e in suffix_entities if e.offset < available_len16]
-                for e in suffix_entities:
-                    if e.offset + e.length > available_len16:
-                        e.length = available_len16 - e.offset
-        else:
-            suffix_text = ""
-            suffix_entities = None
-        
-        # Обновляем итоговый текст
-        out_text = utils.del_surrogate(base_with_sep_utf16) + suffix_text if base else suffix_text
-        out_utf16 = utils.add_surrogate(out_text)
+                # Обрезаем entities суффикса: копируются только те, что пересекают границу
+                suffix_entities = _trim_entities_to_len16(suffix_entities, available_len16)
+            else:
+                suffix_text = ""
+                suffix_entities = None
+
+        out_text = f"{base}{sep}{suffix_text}"
 
     # Формируем итоговые entities
     new_entities = []
@@ -264,10 +271,9 @@ def _append_formatted_suffix(
     if suffix_entities:
         base_offset_utf16 = base_len16 + sep_len16
         for entity in suffix_entities:
-            # Создаем копию entity со смещенным offset в UTF-16
-            new_entity = copy.copy(entity)
-            new_entity.offset += base_offset_utf16
-            new_entities.append(new_entity)
+            # entities суффикса только что созданы парсером — сдвигаем offset на месте, без копий
+            entity.offset += base_offset_utf16
+            new_entities.append(entity)
 
     return out_text, (new_entities or None)
 
@@ -286,39 +292,6 @@ def _extract_caption_and_entities(msg: Message) -> Tuple[str, Optional[List[type
     return msg.message or "", msg.entities or None
 
 
-# -----------------------------------------------------------------------------
-#   Подготовка медиа
-# -----------------------------------------------------------------------------
-async def _prepare_media_for_send(client, msg: Message):
-    """Возвращает параметры для send_message/send_file."""
-    if getattr(msg, "photo", None):
-        return {"mode": "photo", "file": msg.photo, "force_document": False}
-
-    doc = getattr(msg, "document", None)
-    if doc:
-        mime = getattr(doc, "mime_type", "")
-        is_image_doc = bool(mime.startswith("image/"))
-
-        if is_image_doc:
-            data = await client.download_media(msg, bytes)
-            return {"mode": "photo", "file": data, "force_document": False}
-
-        file_name = getattr(msg.file, "name", None)
-        if not file_name:
-            ext = mime.split("/")[-1] if "/" in mime else "bin"
-            file_name = f"file_{msg.id}.{ext}"
-            data = await client.download_media(msg, bytes)
-            attrs = list(getattr(doc, "attributes", []) or [])
-            attrs = [a for a in attrs if not isinstance(a, types.DocumentAttributeFilename)]
-            attrs.append(types.DocumentAttributeFilename(file_name))
-            return {"mode": "document", "file": data, "attributes": attrs, "force_document": True}
-
-        return {"mode": "passthrough", "file": msg, "force_document": True}
-
-    if getattr(msg, "media", None):
-        return {"mode": "passthrough", "file": msg}
-    return {"mode": "text"}
-
 import logging
 log = logging.getLogger("sync")
 log.setLevel(logging.INFO)
@@ -442,13 +415,14 @@ async def _send_album(
         return sent
     except Exception as e:
         print(f"[WARN] Ошибка при отправке альбома — fallback: {e}")
-        # fallback на одиночные сообщения
+        # fallback на одиночные сообщения: строго по очереди, чтобы сохранить порядок поста
+        # и не ловить FloodWait от параллельной отправки в один чат
         sent = []
-        for i, (m, caption, entities) in enumerate(zip(msgs, captions, entities_list)):
+        for i, (media, caption, entities) in enumerate(zip(files, captions, entities_list)):
             try:
                 msg = await client.send_file(
                     target_entity,
-                    m.media,
+                    media,
                     caption=caption,
                     formatting_entities=entities,
                     reply_to=reply_to,
@@ -461,6 +435,9 @@ async def _send_album(
 
 
         
+# -----------------------------------------------------------------------------
+#   Подготовка медиа
+# -----------------------------------------------------------------------------
 async def _prepare_media_for_send(client, msg: Message):
     """Возвращает параметры для send_message/send_file."""
     if getattr(msg, "photo", None):
@@ -489,7 +466,7 @@ async def _prepare_media_for_send(client, msg: Message):
 # -----------------------------------------------------------------------------
 async def build_post(client, source_id: int, limit: int = 5000) -> List[BuiltPost]:
     """Возвращает список собранных постов из источника."""
-    peer = await client.get_entity(source_id)
+    peer = await _resolve(client, source_id)
     msgs: List[Message] = []
     async for m in client.iter_messages(peer, limit=limit):
         if getattr(m, "action", None) or getattr(m, "service", False):
@@ -515,7 +492,7 @@ async def send_post(
     is_add_suffix: bool = False,
 ) -> List[int]:
     """Публикует собранный пост (одиночный или альбом)."""
-    target_entity = await client.get_entity(target_id)
+    target_entity = await _resolve(client, target_id)
     if post.is_album:
         res = await _send_album(
             client,
@@ -1,6 +1,8 @@
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Iterable, List
+from operator import attrgetter
+from typing import Iterable, Iterator, List
+import heapq
 import os
 from zoneinfo import ZoneInfo
 
@@ -11,17 +13,22 @@ def _tz():
     except Exception:
         return ZoneInfo("UTC")
 
-@dataclass
+@dataclass(slots=True)
 class Slot:
     when: datetime
     weekday: int
     seconds_from_start: int
 
-def _next_weekday(base: datetime, wd_db: int) -> datetime:
-    # БД: 0..6 => iso: 1..7
-    target_iso = ((wd_db % 7) + 1)
-    days_ahead = (target_iso - base.isoweekday()) % 7
-    return base + timedelta(days=days_ahead)
+# _AHEAD[iso_base - 1][wd_db] — через сколько дней наступит день недели wd_db (БД: 0..6 => iso: 1..7)
+_AHEAD = tuple(tuple(((w % 7) + 1 - iso) % 7 for w in range(7)) for iso in range(1, 8))
+
+_WEEK = timedelta(days=7)
+
+def _weekly_slots(send_dt: datetime, end: datetime, wd: int, sec: int) -> Iterator[Slot]:
+    """Слоты одного пункта расписания: раз в неделю до конца горизонта (уже по возрастанию)."""
+    while send_dt <= end:
+        yield Slot(when=send_dt, weekday=wd, seconds_from_start=sec)
+        send_dt += _WEEK
 
 def build_slots(now: datetime, items: Iterable[tuple[int, int]], horizon_days: int = 14) -> List[Slot]:
     """
@@ -31,19 +38,18 @@ def build_slots(now: datetime, items: Iterable[tuple[int, int]], horizon_days: i
     tz = now.tzinfo or _tz()
     now = now.astimezone(tz)
     end = now + timedelta(days=horizon_days)
-    out: List[Slot] = []
+    per_item: List[Iterator[Slot]] = []
+    ahead = _AHEAD[now.isoweekday() - 1]
 
     for wd, sec in items:
-        d0 = _next_weekday(now, wd)
+        d0 = now + timedelta(days=ahead[wd % 7])
         hh, rem = divmod(int(sec), 3600)
         mm, ss = divmod(rem, 60)
         send_dt = datetime(d0.year, d0.month, d0.day, hh, mm, ss, tzinfo=tz)
         if send_dt < now:
-            send_dt += timedelta(days=7)
-        while send_dt <= end:
-            out.append(Slot(when=send_dt, weekday=wd, seconds_from_start=sec))
-            send_dt += timedelta(days=7)
+            send_dt += _WEEK
+        per_item.append(_weekly_slots(send_dt, end, wd, sec))
 
-    out.sort(key=lambda s: s.when)
-    return out
+    # Каждый поток уже отсортирован — сливаем их вместо общей сортировки
+    return list(heapq.merge(*per_item, key=attrgetter("when")))
 
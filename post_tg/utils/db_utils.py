@@ -1,8 +1,9 @@
 import logging
-from contextlib import contextmanager
-from sqlalchemy.orm import joinedload
+from contextlib import contextmanager, asynccontextmanager
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload, selectinload
 
-from db import SessionLocal
+from db import SessionLocal, get_async_sessionmaker, engine
 from models import BotSession, EntityPostTask
 
 log = logging.getLogger(__name__)
@@ -21,6 +22,57 @@ def get_session():
         s.close()
 
 
+@asynccontextmanager
+async def get_async_session():
+    s = get_async_sessionmaker()()
+    try:
+        yield s
+    except Exception as e:
+        await s.rollback()
+        log.error("DB error: %s", e)
+        raise
+    finally:
+        await s.close()
+
+
+@contextmanager
+def count_queries(conn=None):
+    """
+    Собирает SQL-запросы, выполненные через conn (по умолчанию — общий sync engine), в список.
+    Если conn — Session, считаются только запросы её соединений (и после commit), поэтому
+    параллельные корутины на общем engine в счёт не попадают; входить в блок до первого запроса сессии.
+    Для dev/CI-проверок на N+1; слушатели снимаются при выходе из блока.
+    """
+    conn = conn if conn is not None else engine
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    if not isinstance(conn, Session):
+        event.listen(conn, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield queries
+        finally:
+            event.remove(conn, "before_cursor_execute", before_cursor_execute)
+        return
+
+    # Сессия берёт соединение на каждую транзакцию — слушаем каждое из них
+    connections = []
+
+    def after_begin(session, transaction, connection):
+        event.listen(connection, "before_cursor_execute", before_cursor_execute)
+        connections.append(connection)
+
+    event.listen(conn, "after_begin", after_begin)
+    try:
+        yield queries
+    finally:
+        event.remove(conn, "after_begin", after_begin)
+        for connection in connections:
+            event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+
 def get_active_bots(session):
     """Возвращает все активные сессии ботов"""
     return session.query(BotSession).filter_by(is_active=True).all()
@@ -37,7 +89,8 @@ def get_tasks(session):
             joinedload(EntityPostTask.bot),
             joinedload(EntityPostTask.source),
             joinedload(EntityPostTask.target),
-            joinedload(EntityPostTask.times),
+            # times — коллекция: отдельный запрос WHERE task_id IN (...) вместо размножения строк в JOIN
+            selectinload(EntityPostTask.times),
         )
         .filter_by(is_global_active=True)
         .all()
@@ -2,24 +2,103 @@
 import logging
 import logging.handlers
 import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from datetime import datetime
-import pytz
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from zoneinfo import ZoneInfo
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, create_engine, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, OperationalError
 import json
 import traceback
 
 # Настройки
-TZ = pytz.timezone(os.getenv("TZ", "Europe/Moscow"))
+TZ = ZoneInfo(os.getenv("TZ", "Europe/Moscow"))
+# Ограничение очереди логгер -> БД: при шторме логов старые записи вытесняются новыми
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "10000"))
 
-class NotificationDBHandler(logging.Handler):
-    """Кастомный обработчик логов для записи в таблицу уведомлений"""
+# SQL-выражения собираются один раз при импорте
+_MODULE_IDS_SQL = text("SELECT code, id FROM api_notificationmodule")
+_TYPE_IDS_SQL = text("SELECT module_id, code, severity, id FROM api_notificationtype")
+# Минимальное описание api_systemnotification (таблица Django) — только колонки, которые пишем
+_notifications = Table(
+    'api_systemnotification', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('notification_code', String, unique=True),
+    Column('module_id', Integer),
+    Column('notification_type_id', Integer, key='type_id'),
+    Column('title', String),
+    Column('message', Text),
+    # details — jsonb; передаём готовую JSON-строку, Postgres приводит её сам
+    Column('details', Text),
+    Column('status', String, default='NEW'),
+    Column('created_at', DateTime(timezone=True)),
+    Column('updated_at', DateTime(timezone=True)),
+    Column('source', String),
+    Column('stack_trace', Text),
+)
+
+# Один UPSERT вместо SELECT + INSERT/UPDATE: notification_code уникален в api_systemnotification.
+# Core-конструкция собирается один раз при импорте и кэшируется SQLAlchemy после первой компиляции;
+# пачка строк уходит одним executemany (insertmanyvalues / execute_values psycopg2)
+_upsert = pg_insert(_notifications)
+_UPSERT_STMT = _upsert.on_conflict_do_update(
+    index_elements=[_notifications.c.notification_code],
+    set_={
+        'message': _upsert.excluded.message,
+        'details': _upsert.excluded.details,
+        'updated_at': _upsert.excluded.updated_at,
+    },
+)
+
+# Схема details фиксирована: emit сохраняет кортеж полей, JSON собирается по шаблону при записи
+_DETAILS_EXTRA = ('entity_id', 'task_id', 'external_id')
+_DETAILS_TMPL = '{"logger":%s,"level":%d,"level_name":%s,"file":%s,"line":%d,"function":%s%s}'
+_json_str = json.encoder.encode_basestring_ascii
+
+def _dumps_details(details):
+    """JSON для поля details из кортежа _extract_details: шаблон со строками через C-экранирование json"""
+    name, levelno, level_name, pathname, lineno, func_name, extra = details
+    tail = ''.join(
+        ',"%s":%s' % (key, json.dumps(value, separators=(',', ':'), default=str)) for key, value in extra
+    ) if extra else ''
+    return _DETAILS_TMPL % (
+        _json_str(name), levelno, _json_str(level_name), _json_str(pathname), lineno,
+        _json_str(func_name) if func_name is not None else 'null', tail
+    )
+
+class BaseNotificationHandler(logging.Handler, ABC):
+    """Общая часть обработчиков уведомлений: разбор записи лога, дедупликация и подготовка строк"""
     
-    def __init__(self, db_url):
-        super().__init__()
-        self.db_url = db_url
-        self.engine = create_engine(db_url)
-        self.Session = sessionmaker(bind=self.engine)
+    # Имена стандартных уровней без logging.getLevelName (тот берёт глобальный лок модуля logging)
+    _LEVEL_NAMES = {
+        logging.DEBUG: 'DEBUG',
+        logging.INFO: 'INFO',
+        logging.WARNING: 'WARNING',
+        logging.ERROR: 'ERROR',
+        logging.CRITICAL: 'CRITICAL',
+    }
+    
+    def __init__(self):
+        # Фильтр по уровню — на уровне обработчика (по умолчанию WARNING): записи ниже не доходят до emit
+        super().__init__(level=logging.WARNING)
+        
+        # Буфер уведомлений: пишем пачкой по размеру или по таймеру
+        self._max_batch = 500
+        self._max_delay_s = 1.0
+        
+        # Справочники модулей и типов уведомлений (маленькие и почти статичные)
+        self._module_ids = {}
+        self._type_ids = {}
+        
+        # Недавно записанные уведомления: code -> (hash сообщения, время); повторы в пределах TTL пропускаем
+        self._recent = OrderedDict()
+        self._recent_cap = 1024
+        self._recent_ttl = 60.0
         
         # Маппинг уровней логирования на severity уведомлений
         self.level_mapping = {
@@ -42,14 +121,18 @@ class NotificationDBHandler(logging.Handler):
             'reaction_booster': '008',
             'system': '999'
         }
+        
+        # Все коды MOD-TYP-SEV для известных модулей и уровней WARNING..CRITICAL — считаются один раз
+        self._code_table = {
+            (module_code, type_code, level): self._format_notification_code(module_code, type_code, level)
+            for module_code in set(self.module_mapping.values())
+            for type_code in ('001', '002', '003')
+            for level in (logging.WARNING, logging.ERROR, logging.CRITICAL)
+        }
 
     def emit(self, record):
         """Обрабатывает запись лога и создает уведомление в БД"""
         try:
-            # Пропускаем логи ниже WARNING (можно настроить)
-            if record.levelno < logging.WARNING:
-                return
-                
             # Определяем модуль
             module_name = self._extract_module_name(record.name)
             module_code = self.module_mapping.get(module_name, '999')  # system по умолчанию
@@ -60,6 +143,10 @@ class NotificationDBHandler(logging.Handler):
             # Генерируем код уведомления
             notification_code = self._generate_notification_code(module_code, type_code, record.levelno)
             
+            # Тот же код с тем же текстом недавно уже записан — повторный UPSERT ничего не изменит
+            if self._is_recent_duplicate(notification_code, record):
+                return
+            
             # Подготавливаем данные
             notification_data = {
                 'notification_code': notification_code,
@@ -67,24 +154,38 @@ class NotificationDBHandler(logging.Handler):
                 'type_code': type_code,
                 'severity': self.level_mapping.get(record.levelno, 30),
                 'title': self._generate_title(record),
-                'message': self.format(record),
+                # message, stack_trace и JSON details считаются при сбросе — только для реально записываемых строк
+                'record': record,
                 'details': self._extract_details(record),
                 'source': record.name,
-                'stack_trace': getattr(record, 'exc_text', ''),
-                'created_at': datetime.now(TZ)
+                # Время записи лога (float); в datetime переводим только при сбросе в БД
+                'created_at': record.created
             }
             
-            # Сохраняем в БД
-            self._save_to_db(notification_data)
+            # Копим в буфер; в БД пишет flush() пачкой
+            self._enqueue(notification_data)
             
         except Exception as e:
             # Fallback на обычный вывод если БД недоступна
             print(f"ERROR saving notification to DB: {e}")
 
+    def _is_recent_duplicate(self, notification_code, record):
+        """LRU по notification_code: True, если такое же сообщение уже было в пределах TTL"""
+        now = time.monotonic()
+        message_hash = hash(record.getMessage())
+        seen = self._recent.get(notification_code)
+        if seen and seen[0] == message_hash and now - seen[1] < self._recent_ttl:
+            return True
+        self._recent[notification_code] = (message_hash, now)
+        self._recent.move_to_end(notification_code)
+        if len(self._recent) > self._recent_cap:
+            self._recent.popitem(last=False)
+        return False
+
     def _extract_module_name(self, logger_name):
         """Извлекает имя модуля из имени логгера"""
         if '.' in logger_name:
-            return logger_name.split('.')[0]
+            return logger_name.partition('.')[0]
         return logger_name
 
     def _get_type_code(self, level):
@@ -98,114 +199,270 @@ class NotificationDBHandler(logging.Handler):
 
     def _generate_notification_code(self, module_code, type_code, severity_level):
         """Генерирует код уведомления: MOD-TYP-SEV"""
+        code = self._code_table.get((module_code, type_code, severity_level))
+        if code is None:
+            # Нестандартный уровень — собираем код как раньше
+            code = self._format_notification_code(module_code, type_code, severity_level)
+        return code
+
+    @staticmethod
+    def _format_notification_code(module_code, type_code, severity_level):
         severity_code = str(severity_level // 10).zfill(2)
         return f"{module_code}-{type_code}-{severity_code}"
 
+    def _level_name(self, levelno):
+        # Нестандартные уровни — как раньше, через logging
+        return self._LEVEL_NAMES.get(levelno) or logging.getLevelName(levelno)
+
     def _generate_title(self, record):
         """Генерирует заголовок уведомления"""
-        level_name = logging.getLevelName(record.levelno)
+        level_name = self._level_name(record.levelno)
         module_name = self._extract_module_name(record.name)
-        return f"[{module_name}] {level_name}: {record.getMessage().split('.')[0]}"
+        return f"[{module_name}] {level_name}: {record.getMessage().partition('.')[0]}"
 
     def _extract_details(self, record):
-        """Извлекает дополнительные детали из записи лога"""
-        details = {
-            'logger': record.name,
-            'level': record.levelno,
-            'level_name': logging.getLevelName(record.levelno),
-            'file': record.pathname,
-            'line': record.lineno,
-            'function': record.funcName,
-        }
+        """Извлекает детали из записи лога кортежем фиксированной схемы (без dict на каждое событие)"""
+        # Дополнительные поля — только если есть
+        rd = record.__dict__
+        extra = tuple((key, rd[key]) for key in _DETAILS_EXTRA if key in rd)
+        return (
+            record.name, record.levelno, self._level_name(record.levelno),
+            record.pathname, record.lineno, record.funcName, extra
+        )
+
+    @abstractmethod
+    def _enqueue(self, notification_data):
+        """Передаёт подготовленное уведомление на запись (буфер, очередь и т.п.)"""
+
+    @staticmethod
+    def _collapse(batch):
+        """Схлопывает повторы кода в пачке: заголовок и created_at — от первой записи,
+        message/details/updated_at — от последней (как при последовательной записи)"""
+        by_code = {}
+        for data in batch:
+            first = by_code.get(data['notification_code'])
+            if first is None:
+                by_code[data['notification_code']] = dict(data, updated_at=data['created_at'])
+            else:
+                first.update(record=data['record'], details=data['details'], updated_at=data['created_at'])
+        return by_code
+
+    def _needs_lookups(self, by_code):
+        """Есть ли в пачке модули, которых нет в кэше справочников"""
+        return any(data['module_code'] not in self._module_ids for data in by_code.values())
+
+    def _build_rows(self, by_code):
+        """Готовит строки для UPSERT; module_id / notification_type_id — из кэша справочников"""
+        rows = []
+        for code, data in by_code.items():
+            module_id = self._module_ids.get(data['module_code'])
+            if module_id is None:
+                # Модуля нет в справочнике — уведомление не создаём (как и раньше через JOIN)
+                continue
+            record = data['record']
+            message = self.format(record)  # заполняет record.exc_text для stack_trace
+            # Через очередь traceback приходит в record.stack_trace (см. DroppingQueueHandler.prepare)
+            stack_trace = getattr(record, 'stack_trace', None) or record.exc_text or ''
+            rows.append({
+                'notification_code': code,
+                'module_id': module_id,
+                'type_id': self._type_ids.get((module_id, data['type_code'], data['severity'])),
+                'title': data['title'],
+                'message': message,
+                'details': _dumps_details(data['details']),
+                'source': data['source'],
+                'stack_trace': stack_trace,
+                'created_at': datetime.fromtimestamp(data['created_at'], TZ),
+                'updated_at': datetime.fromtimestamp(data['updated_at'], TZ)
+            })
+        return rows
+
+
+class NotificationDBHandler(BaseNotificationHandler):
+    """Кастомный обработчик логов для записи в таблицу уведомлений"""
+    
+    def __init__(self, db_url):
+        super().__init__()
+        self.db_url = db_url
+        self.engine = create_engine(db_url, **self._engine_options(db_url))
+        # QueueListener, который кормит обработчик (ставит setup_notification_logging); close() его останавливает
+        self.listener = None
+        # Одно долгоживущее соединение на обработчик; запись сериализуется _write_lock
+        self._conn = None
+        self._write_lock = threading.Lock()
         
-        # Добавляем дополнительные поля если есть
-        if hasattr(record, 'entity_id'):
-            details['entity_id'] = record.entity_id
-        if hasattr(record, 'task_id'):
-            details['task_id'] = record.task_id
-        if hasattr(record, 'external_id'):
-            details['external_id'] = record.external_id
-            
-        return json.dumps(details)
+        # Буфер до flush(): сбрасывается по _max_batch или по таймеру _max_delay_s
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flush_timer = None
+        
+        self._load_lookups()
+
+    def _connection(self):
+        """Возвращает соединение обработчика, открывая его при первом обращении"""
+        if self._conn is None or self._conn.closed:
+            self._conn = self.engine.connect()
+        return self._conn
 
-    def _save_to_db(self, notification_data):
-        """Сохраняет уведомление в БД через SQLAlchemy"""
-        session = self.Session()
+    def _drop_connection(self, error):
+        """После обрыва соединения закрываем его; следующий сброс переподключится"""
+        if isinstance(error, OperationalError) or (isinstance(error, DBAPIError) and error.connection_invalidated):
+            try:
+                if self._conn is not None:
+                    self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _load_lookups(self):
+        """Загружает id модулей {code: id} и типов {(module_id, code, severity): id}"""
         try:
-            # Проверяем, не существует ли уже такое уведомление (по коду)
-            check_sql = text("""
-                SELECT id FROM api_systemnotification 
-                WHERE notification_code = :code 
-                AND status IN ('NEW', 'ACKNOWLEDGED', 'IN_PROGRESS')
-                LIMIT 1
-            """)
-            result = session.execute(check_sql, {'code': notification_data['notification_code']}).fetchone()
-            
-            if result:
-                # Обновляем существующее уведомление
-                update_sql = text("""
-                    UPDATE api_systemnotification 
-                    SET message = :message, details = :details, updated_at = :updated_at
-                    WHERE notification_code = :code
-                """)
-                session.execute(update_sql, {
-                    'message': notification_data['message'],
-                    'details': notification_data['details'],
-                    'updated_at': notification_data['created_at'],
-                    'code': notification_data['notification_code']
-                })
-            else:
-                # Создаем новое уведомление
-                insert_sql = text("""
-                    INSERT INTO api_systemnotification (
-                        notification_code, module_id, notification_type_id, 
-                        title, message, details, status, created_at, updated_at,
-                        source, stack_trace
-                    ) 
-                    SELECT 
-                        :notification_code,
-                        m.id,
-                        nt.id,
-                        :title,
-                        :message,
-                        :details,
-                        'NEW',
-                        :created_at,
-                        :created_at,
-                        :source,
-                        :stack_trace
-                    FROM api_notificationmodule m
-                    LEFT JOIN api_notificationtype nt ON (
-                        nt.module_id = m.id AND 
-                        nt.code = :type_code AND 
-                        nt.severity = :severity
-                    )
-                    WHERE m.code = :module_code
-                    LIMIT 1
-                """)
-                session.execute(insert_sql, {
-                    'notification_code': notification_data['notification_code'],
-                    'module_code': notification_data['module_code'],
-                    'type_code': notification_data['type_code'],
-                    'severity': notification_data['severity'],
-                    'title': notification_data['title'],
-                    'message': notification_data['message'],
-                    'details': notification_data['details'],
-                    'source': notification_data['source'],
-                    'stack_trace': notification_data['stack_trace'],
-                    'created_at': notification_data['created_at']
-                })
-            
-            session.commit()
-            
+            conn = self._connection()
+            with conn.begin():
+                module_ids = {code: id_ for code, id_ in conn.execute(_MODULE_IDS_SQL)}
+                type_ids = {
+                    (module_id, code, severity): id_
+                    for module_id, code, severity, id_ in conn.execute(_TYPE_IDS_SQL)
+                }
+            self._module_ids, self._type_ids = module_ids, type_ids
+        except Exception as e:
+            self._drop_connection(e)
+            print(f"Database error loading notification lookups: {e}")
+
+    @staticmethod
+    def _engine_options(db_url):
+        """Пул на одно соединение для логгера; на psycopg2 — пакетный executemany (execute_batch/execute_values)"""
+        if make_url(db_url).drivername not in ("postgresql", "postgresql+psycopg2"):
+            return {}
+        return dict(
+            executemany_mode="values_plus_batch",
+            insertmanyvalues_page_size=1000,
+            executemany_batch_page_size=500,
+            pool_pre_ping=True,
+            pool_size=1,
+            max_overflow=0,
+        )
+
+    def _enqueue(self, notification_data):
+        """Добавляет уведомление в буфер и планирует сброс"""
+        with self._buffer_lock:
+            self._buffer.append(notification_data)
+            if len(self._buffer) < self._max_batch:
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(self._max_delay_s, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Записывает накопленные уведомления в БД одной транзакцией"""
+        with self._buffer_lock:
+            batch, self._buffer = self._buffer, []
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        if batch:
+            with self._write_lock:
+                self._save_batch(batch)
+
+    def close(self):
+        # Сначала дожидаемся, пока слушатель разберёт очередь, затем дописываем буфер
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            try:
+                listener.stop()
+            except Exception as e:
+                print(f"ERROR stopping notification listener: {e}")
+        self.flush()
+        with self._write_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self.engine.dispose()
+        super().close()
+
+    def _save_batch(self, batch):
+        """Сохраняет пачку уведомлений одним executemany UPSERT"""
+        by_code = self._collapse(batch)
+        # Новые коды модулей — одна перечитка справочников на пачку
+        if self._needs_lookups(by_code):
+            self._load_lookups()
+
+        rows = self._build_rows(by_code)
+        if not rows:
+            return
+
+        try:
+            conn = self._connection()
+            with conn.begin():
+                conn.execute(_UPSERT_STMT, rows)
         except Exception as e:
-            session.rollback()
+            self._drop_connection(e)
             print(f"Database error in notification handler: {e}")
-        finally:
-            session.close()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler для ограниченной очереди: при переполнении выбрасывает самую старую запись.
+    Раз в drop_report_every потерь кладёт в очередь одну CRITICAL-запись о переполнении
+    (код уведомления у неё один, так что в БД это одна обновляемая строка).
+    """
+
+    def __init__(self, log_queue, drop_report_every=1000):
+        super().__init__(log_queue)
+        self.drop_report_every = drop_report_every
+        self.dropped = 0
+        # Значение dropped на момент последнего отчёта: отчёт — только при новых drop_report_every потерях
+        self._last_reported = 0
+
+    def prepare(self, record):
+        # QueueHandler.prepare вклеивает traceback в msg и обнуляет exc_text у копии;
+        # у исходной записи exc_text уже заполнен форматтером — сохраняем его для stack_trace
+        prepared = super().prepare(record)
+        prepared.stack_trace = record.exc_text or ''
+        return prepared
+
+    def enqueue(self, record):
+        # Handler.handle держит self.lock — enqueue не выполняется параллельно
+        self._put(record)
+        if self.dropped - self._last_reported >= self.drop_report_every:
+            self._last_reported = self.dropped
+            self._report_overflow()
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass  # QueueListener успел разобрать очередь
+        self.dropped += 1
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _report_overflow(self):
+        record = logging.LogRecord(
+            'system.notifications', logging.CRITICAL, __file__, 0,
+            '🚨 Очередь уведомлений переполнена, отброшено записей: %d', (self.dropped,), None
+        )
+        self._put(self.prepare(record))
+
 
 def setup_notification_logging(db_url, level=logging.WARNING):
-    """Настраивает систему логирования с уведомлениями"""
+    """
+    Настраивает систему логирования с уведомлениями.
+
+    Логгеры пишут в QueueHandler (только queue.put), а запись в БД выполняет
+    NotificationDBHandler в фоновом потоке QueueListener.
+    Возвращает db_handler (слушатель доступен как db_handler.listener); при завершении
+    вызовите db_handler.close() — он остановит слушатель, допишет буфер и закроет соединение.
+    """
     
     # Создаем обработчик для БД
     db_handler = NotificationDBHandler(db_url)
@@ -217,10 +474,19 @@ def setup_notification_logging(db_url, level=logging.WARNING):
     )
     db_handler.setFormatter(formatter)
     
+    # Очередь между логгерами и БД: emit в рабочем потоке не ждёт SQL
+    # Очередь ограничена NOTIFICATION_QUEUE_SIZE: если БД тормозит, память не растёт без предела
+    log_queue = queue.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, db_handler, respect_handler_level=True)
+    listener.start()
+    db_handler.listener = listener
+    
     # Настраиваем корневой логгер
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(db_handler)
+    root_logger.addHandler(queue_handler)
     
     # Настраиваем специфичные логгеры для модулей
     modules = [
@@ -228,11 +494,12 @@ def setup_notification_logging(db_url, level=logging.WARNING):
         'pinner', 'view_booster', 'subscribers_booster', 'reaction_booster'
     ]
     
+    # Обработчик висит только на корне: записи модулей (и их подмодулей)
+    # доходят до него по propagate ровно один раз, остальные хендлеры
+    # корня (stdout и т.п.) тоже продолжают получать сообщения
     for module in modules:
         module_logger = logging.getLogger(module)
         module_logger.setLevel(logging.INFO)
-        module_logger.addHandler(db_handler)
-        # Предотвращаем дублирование сообщений
-        module_logger.propagate = False
+        module_logger.propagate = True
     
     return db_handler
@@ -2,9 +2,34 @@
 import re
 from typing import Tuple, Optional
 
-_TME_C = re.compile(r"https?://t\.me/c/(\d+)/(\d+)")
-_TME_USER = re.compile(r"https?://t\.me/([A-Za-z0-9_]+)/(\d+)")
-_PLAIN_USER = re.compile(r"^@?([A-Za-z0-9_]+)/(\d+)$")
+# Одна альтернатива вместо трёх регэкспов (порядок веток = прежний порядок проверок):
+#   1,3 — https://t.me/c/<id>/<mid>; 2,3 — https://t.me/<username>/<mid>; 4,5 — @username/<mid>
+# Сопоставление через .match, как у прежних регэкспов: после номера поста в URL допускается
+# любой хвост (?single, /, текст...), а @username/<mid> должен занимать всю строку (\Z).
+# re.ASCII — \d только 0-9 (без арабских и прочих цифр).
+_POST_LINK = re.compile(
+    r"https?://t\.me/(?:c/(\d+)|([A-Za-z0-9_]+))/(\d+)"
+    r"|@?([A-Za-z0-9_]+)/(\d+)\Z",
+    re.ASCII,
+)
+
+_CHANNEL_PREFIX = 10 ** 12
+_INNER_MIN, _INNER_MAX = 10 ** 9, 10 ** 10
+
+def _post_link_tuple(m: "re.Match") -> Tuple[Optional[int], Optional[str], int]:
+    inner_id, username, mid, plain_username, plain_mid = m.groups()
+    if inner_id:
+        # Правильное преобразование для каналов: -100 + inner_id.
+        # Для обычного 10-значного inner_id — чистая арифметика без строк.
+        n = int(inner_id)
+        if _INNER_MIN <= n < _INNER_MAX:
+            chat_id = -_CHANNEL_PREFIX - n
+        else:
+            chat_id = -int("100" + str(n))
+        return (chat_id, None, int(mid))
+    if username:
+        return (None, username, int(mid))
+    return (None, plain_username, int(plain_mid))
 
 def parse_post_link(link: str) -> Tuple[Optional[int], Optional[str], int]:
     """
@@ -13,20 +38,9 @@ def parse_post_link(link: str) -> Tuple[Optional[int], Optional[str], int]:
     """
     link = (link or "").strip()
 
-    m = _TME_C.match(link)
+    m = _POST_LINK.match(link)
     if m:
-        inner_id = int(m.group(1))
-        mid = int(m.group(2))
-        # Правильное преобразование для каналов: -100 + inner_id
-        chat_id = int(f"-100{inner_id}")
-        return (chat_id, None, mid)
+        return _post_link_tuple(m)
 
-    m = _TME_USER.match(link)
-    if m:
-        return (None, m.group(1), int(m.group(2)))
-
-    m = _PLAIN_USER.match(link)
-    if m:
-        return (None, m.group(1), int(m.group(2)))
+    raise ValueError(f"Unsupported Telegram post link: {link}")
 
-    raise ValueError(f"Unsupported Telegram post link: {link}")
\ No newline at end of file
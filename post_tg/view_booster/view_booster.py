@@ -3,26 +3,28 @@
 import os
 import asyncio
 import logging
-from datetime import datetime, timedelta, time
-from typing import Dict, List, Optional, Tuple, Set
-import pytz
-import requests
-from urllib3.exceptions import InsecureRequestWarning
+import time as time_mod
+from datetime import datetime, timedelta, time, timezone
+from zoneinfo import ZoneInfo
+from typing import Any, Dict, List, Optional, Tuple, Set
+import aiohttp
+import heapq
 import random
-
-# Отключаем предупреждения о небезопасных SSL запросах
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+from array import array
+from bisect import bisect_right
+from operator import attrgetter
+from contextlib import contextmanager
 
 from telethon import TelegramClient, events
 from telethon import functions
 from telethon.tl.types import Channel, Chat, MessageService, Message
-from sqlalchemy import select, desc
-from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy import select, desc, update
+from sqlalchemy.orm import selectinload, joinedload, raiseload
 
-from utils.db_utils import get_session
+from utils.db_utils import get_session, count_queries
 from telegram_client import init_user_client
 from entity_resolver import ensure_peer
-from models import ViewBoostTask, ViewDistribution, ViewBoostExpense, MainEntity, BotSession, BoosterSettings, BoosterServiceRotation, BoosterTariff
+from models import ViewBoostTask, ViewDistribution, ViewBoostExpense, MainEntity, BotSession, BoosterSettings, BoosterServiceRotation, BoosterOrder
 
 # Настройка логирования
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
@@ -32,8 +34,26 @@ log = logging.getLogger("view_booster")
 
 # Константы
 CHECK_INTERVAL = int(os.getenv("VIEW_BOOST_CHECK_INTERVAL", "30"))
-TZ = pytz.timezone(os.getenv("TZ", "Europe/Moscow"))
-UTC_TZ = pytz.UTC
+# Настройки бустера и распределения просмотров почти статичны — перечитываем не чаще раза в SETTINGS_TTL
+SETTINGS_TTL = int(os.getenv("VIEW_BOOST_SETTINGS_TTL", "300"))
+# Сколько секунд переиспользуем данные задачи из _get_fresh_task_data при всплеске сообщений
+FRESH_TASK_TTL = float(os.getenv("VIEW_BOOST_FRESH_TASK_TTL", "1.5"))
+# Сколько постов одного канала одновременно обрабатывают свой час (отправка просмотров)
+PROCESS_CONCURRENCY = int(os.getenv("VIEW_BOOST_PROCESS_CONCURRENCY", "4"))
+# Как часто пересканируем историю каналов у уже работающих трекеров, секунд
+HISTORY_RECHECK_INTERVAL = int(os.getenv("VIEW_BOOST_HISTORY_RECHECK_INTERVAL", "3600"))
+# Сколько трекеров одновременно инициализируем (подписчики, обработчик, история) — клиенты общие
+TRACKER_INIT_CONCURRENCY = int(os.getenv("VIEW_BOOST_TRACKER_INIT_CONCURRENCY", "4"))
+# Сколько исторических сообщений канала обрабатываем одновременно
+HISTORY_CONCURRENCY = int(os.getenv("VIEW_BOOST_HISTORY_CONCURRENCY", "8"))
+# Сколько секунд помним первую часть альбома (части приходят почти одновременно)
+ALBUM_SEEN_TTL = int(os.getenv("VIEW_BOOST_ALBUM_SEEN_TTL", "600"))
+# Подсчёт SQL-запросов api_send_views (см. count_queries) — только по явному включению, по умолчанию выключен
+VIEW_BOOST_COUNT_QUERIES = os.getenv("VIEW_BOOST_COUNT_QUERIES", "false").lower() in ("1", "true", "yes")
+# Порог числа SQL-запросов на вызов api_send_views при VIEW_BOOST_COUNT_QUERIES
+VIEW_BOOST_MAX_QUERIES = int(os.getenv("VIEW_BOOST_MAX_QUERIES", "5"))
+TZ = ZoneInfo(os.getenv("TZ", "Europe/Moscow"))
+UTC_TZ = timezone.utc
 
 # Настройки прокси
 PROXY_URL = os.getenv("HTTP_PROXY") or os.getenv("HTTPS_PROXY")
@@ -52,68 +72,172 @@ EVENING_END = time(21, 59)    # 21:59
 NIGHT_START = time(22, 0)     # 22:00
 NIGHT_END = time(4, 59)       # 4:59 следующего дня
 
-def _safe_twiboost_get(endpoint: str, api_key: str, params: str = "") -> tuple:
+# Тип поста по часу публикации (0..23): ночь 22-4, утро 5-9, день 10-15, вечер 16-21
+_POST_TYPE_BY_HOUR = (
+    ("night",) * 5 + ("morning",) * 5 + ("day",) * 6 + ("evening",) * 6 + ("night",) * 2
+)
+
+# Общая HTTP-сессия Twiboost: keep-alive между запросами вместо нового TCP+TLS на каждый вызов
+_AIOHTTP: Optional[aiohttp.ClientSession] = None
+
+# Повторы при 429/5xx и сетевых ошибках: экспоненциальная пауза через asyncio.sleep
+TWIBOOST_RETRIES = 3
+TWIBOOST_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Ограничение нагрузки на API: не больше TWIBOOST_MAX_INFLIGHT запросов одновременно
+# и не чаще TWIBOOST_RATE в секунду (с запасом TWIBOOST_BURST на всплеск)
+TWIBOOST_MAX_INFLIGHT = int(os.getenv("TWIBOOST_MAX_INFLIGHT", "8"))
+TWIBOOST_RATE = float(os.getenv("TWIBOOST_RATE", "5"))
+TWIBOOST_BURST = int(os.getenv("TWIBOOST_BURST", "10"))
+
+
+class AsyncRateLimiter:
+    """Token bucket для asyncio: acquire() ждёт, пока в ведре не появится токен"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time_mod.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time_mod.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+_TWIBOOST_SEM = asyncio.Semaphore(TWIBOOST_MAX_INFLIGHT)
+# Сколько постов одновременно могут быть внутри api_send_views (БД + запросы к API)
+_API_SEND_SEM = asyncio.Semaphore(int(os.getenv("VIEW_BOOST_MAX_CONCURRENCY", "4")))
+_rate_limiter = AsyncRateLimiter(TWIBOOST_RATE, TWIBOOST_BURST)
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Пауза перед повтором: Retry-After от API, если задан, иначе экспонента с джиттером"""
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    return 0.5 * 2 ** attempt + random.random()
+
+async def get_aiohttp_session() -> aiohttp.ClientSession:
+    """Лениво создаёт общую aiohttp-сессию (внутри работающего event loop)"""
+    global _AIOHTTP
+    if _AIOHTTP is None or _AIOHTTP.closed:
+        _AIOHTTP = aiohttp.ClientSession(
+            headers={"User-Agent": "Mozilla/5.0", "Accept": "application/json,text/plain,*/*"},
+            timeout=aiohttp.ClientTimeout(total=15),
+            # DNS twiboost.com кэшируется на 5 минут, простаивающие соединения живут минуту —
+            # холодное соединение после обрыва keep-alive не ждёт повторного резолва
+            connector=aiohttp.TCPConnector(
+                ssl=False, limit=64, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=60
+            ),
+        )
+    return _AIOHTTP
+
+async def close_aiohttp_session():
+    """Закрывает общую aiohttp-сессию при остановке модуля"""
+    global _AIOHTTP
+    if _AIOHTTP is not None and not _AIOHTTP.closed:
+        await _AIOHTTP.close()
+    _AIOHTTP = None
+
+async def _safe_twiboost_get(endpoint: str, api_key: str, params: Optional[Dict[str, object]] = None,
+                             idempotent: bool = True) -> tuple:
     """
-    Универсальный запрос к Twiboost через прокси.
+    Универсальный запрос к Twiboost через прокси (не блокирует event loop).
+    idempotent=False (action=add создаёт платный заказ): таймаут или 5xx могли прийти уже после
+    создания заказа, поэтому повторяем только 429 и неудавшееся соединение — запрос точно не ушёл.
     Возвращает: (success, data, error_message)
     """
     base_urls = [
         "https://twiboost.com/api/v2"
     ]
 
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Accept": "application/json,text/plain,*/*",
-    }
+    http = await get_aiohttp_session()
 
     for base in base_urls:
-        try:
-            full_url = f"{base}?action={endpoint}&key={api_key}"
-            if params:
-                full_url += f"&{params}"
-                
-            log.debug(f"📊 API запрос: {base}?action={endpoint}&{params.split('&key=')[0]}...")
-
-            response = requests.get(
-                full_url,
-                headers=headers,
-                timeout=15,
-                verify=False,
-                proxies=PROXIES,
-            )
+        # Параметры словарём: aiohttp сам кодирует query (и ссылку на пост внутри неё)
+        query = {"action": endpoint, "key": api_key, **(params or {})}
+        
+        if log.isEnabledFor(logging.DEBUG):
+            safe_query = {k: v for k, v in query.items() if k != "key"}
+            log.debug(f"📊 API запрос: {base} {safe_query}")
 
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    return True, data, None
-                except Exception as e:
-                    log.warning(f"⚠️ Ошибка парсинга JSON: {e}")
-                    continue
-            else:
-                log.warning(f"⚠️ API вернул статус {response.status_code}: {response.text[:200]}")
-        except requests.exceptions.Timeout:
-            log.error(f"⏱️ Таймаут при подключении к {base}")
-            continue
-        except requests.exceptions.ProxyError as e:
-            log.error(f"🔌 Ошибка прокси: {e}")
-            return False, None, f"Proxy error: {e}"
-        except Exception as e:
-            log.warning(f"⚠️ Ошибка запроса к {base}: {e}")
-            continue
+        for attempt in range(TWIBOOST_RETRIES + 1):
+            retry_after = None
+            retryable = idempotent
+            try:
+                async with _TWIBOOST_SEM:
+                    await _rate_limiter.acquire()
+                    async with http.get(base, params=query, proxy=PROXY_URL) as response:
+                        if response.status == 200:
+                            try:
+                                data = await response.json(content_type=None)
+                                return True, data, None
+                            except Exception as e:
+                                log.warning(f"⚠️ Ошибка парсинга JSON: {e}")
+                                break
+                        text = await response.text()
+                        log.warning(f"⚠️ API вернул статус {response.status}: {text[:200]}")
+                        if response.status not in TWIBOOST_RETRY_STATUSES:
+                            break
+                        if response.status == 429:
+                            retry_after = response.headers.get("Retry-After")
+                            retryable = True
+            except asyncio.TimeoutError:
+                log.error(f"⏱️ Таймаут при подключении к {base}")
+            except aiohttp.ClientProxyConnectionError as e:
+                log.error(f"🔌 Ошибка прокси: {e}")
+                return False, None, f"Proxy error: {e}"
+            except aiohttp.ClientConnectorError as e:
+                # Соединение не установлено — запрос до API не дошёл, повтор безопасен
+                log.warning(f"🔌 Не удалось подключиться к {base}: {e}")
+                retryable = True
+            except Exception as e:
+                log.warning(f"⚠️ Ошибка запроса к {base}: {e}")
+
+            if not retryable:
+                break
+
+            # Пауза — вне семафора, чтобы не держать слот во время ожидания
+            if attempt < TWIBOOST_RETRIES:
+                await asyncio.sleep(_retry_delay(attempt, retry_after))
 
     return False, None, "All API endpoints failed"
 
+# Кэш на процесс: (time.monotonic() загрузки, значение)
+_SETTINGS_CACHE: Optional[Tuple[float, BoosterSettings]] = None
+_DIST_CACHE: Optional[Tuple[float, tuple]] = None
+
 def get_booster_settings(session) -> Optional[BoosterSettings]:
-    """Получает глобальные настройки бустера из БД с использованием существующей сессии"""
+    """
+    Получает глобальные настройки бустера (вместе с тарифами) с использованием существующей сессии.
+    Результат кэшируется на SETTINGS_TTL: объект отсоединён от сессии, но tariffs уже загружены.
+    """
+    global _SETTINGS_CACHE
+    cached = _SETTINGS_CACHE
+    if cached and time_mod.monotonic() - cached[0] < SETTINGS_TTL:
+        return cached[1]
+
     try:
         settings = session.execute(
-            select(BoosterSettings)
-        ).unique().scalar_one_or_none()
+            select(BoosterSettings).options(selectinload(BoosterSettings.tariffs))
+        ).scalar_one_or_none()
         
         if settings:
             log.info(f"✅ Загружены глобальные настройки бустера: "
                     f"API ключ={'***' + settings.api_key[-4:] if settings.api_key else '🚨 НЕТ'}, "
                     f"URL={settings.url or '🚨 НЕТ'}")
+            _SETTINGS_CACHE = (time_mod.monotonic(), settings)
             return settings
         else:
             log.error("❌ Глобальные настройки бустера не найдены в БД")
@@ -124,30 +248,52 @@ def get_booster_settings(session) -> Optional[BoosterSettings]:
         return None
 
 def get_view_distributions(session):
-    """Получает распределения просмотров для всех типов постов с использованием существующей сессии"""
+    """
+    Получает распределения просмотров для всех типов постов с использованием существующей сессии.
+    Результат кэшируется на SETTINGS_TTL.
+    """
+    global _DIST_CACHE
+    cached = _DIST_CACHE
+    if cached and time_mod.monotonic() - cached[0] < SETTINGS_TTL:
+        return cached[1]
+
     try:
         stmt = select(ViewDistribution)
         dist = session.execute(stmt).scalar_one_or_none()
         if dist:
-            return dist.morning_distribution, dist.day_distribution, dist.evening_distribution, dist.night_distribution
+            result = (dist.morning_distribution, dist.day_distribution, dist.evening_distribution, dist.night_distribution)
         else:
             log.warning("⚠️ Распределения просмотров не найдены в БД, используются значения по умолчанию")
-            return {}, {}, {}, {}
+            result = ({}, {}, {}, {})
+        _DIST_CACHE = (time_mod.monotonic(), result)
+        return result
     except Exception as e:
         log.error(f"❌ Ошибка загрузки распределений просмотров: {e}")
         return {}, {}, {}, {}
 
+_MIN_LIMIT = attrgetter("min_limit")
+
+# Индекс распределения в кортеже get_view_distributions по типу поста (остальное — ночь)
+_POST_TYPE_INDEX = {"morning": 0, "day": 1, "evening": 2, "night": 3}
+
+def build_hour_percents(distribution: dict, day_type: str) -> array:
+    """Таблица процентов по относительному часу: индекс 1..24 (ключи в JSON бывают и строками, и числами)"""
+    day_distribution = distribution.get(day_type, {})
+    return array('d', (
+        float(day_distribution.get(str(hour)) or day_distribution.get(hour) or 0)
+        for hour in range(25)
+    ))
+
 def get_entity_timezone(entity: MainEntity):
     """
-    Возвращает pytz.FixedOffset для страны сущности.
-    Если страна не указана, возвращает Москву.
+    Возвращает фиксированный datetime.timezone для страны сущности.
+    Если страна не указана, возвращает UTC.
     """
-    from datetime import timedelta
     delta = 0
     if entity and getattr(entity, "country", None) and entity.country.time_zone_delta is not None:
         delta = entity.country.time_zone_delta
     # Смещение в минутах
-    return pytz.FixedOffset(int(delta * 60))
+    return timezone(timedelta(minutes=int(delta * 60)))
 
 async def get_service_id(views_count: int) -> int:
     with get_session() as session:
@@ -167,12 +313,35 @@ async def get_service_id(views_count: int) -> int:
 
 async def api_send_views(views_count: int, tg_post_link: str, task_id: int = None) -> List[dict]:
     """Отправляет запрос на API для накрутки просмотров через прокси."""
+    # Посты, сработавшие в один час, проходят сюда не больше VIEW_BOOST_MAX_CONCURRENCY одновременно
+    async with _API_SEND_SEM:
+        return await _api_send_views(views_count, tg_post_link, task_id)
+
+@contextmanager
+def _query_budget(session):
+    """
+    При VIEW_BOOST_COUNT_QUERIES считает SQL-запросы сессии вызова — страховка от возврата N+1.
+    Считаются только соединения этой сессии: писатель БД и другие трекеры в счёт не попадают.
+    """
+    if not VIEW_BOOST_COUNT_QUERIES:
+        yield
+        return
+    with count_queries(session) as queries:
+        yield
+    log.debug(f"🔍 api_send_views: {len(queries)} SQL-запросов")
+    if len(queries) > VIEW_BOOST_MAX_QUERIES:
+        log.warning(f"⚠️ api_send_views выполнил {len(queries)} SQL-запросов "
+                   f"(порог {VIEW_BOOST_MAX_QUERIES})")
+
+async def _api_send_views(views_count: int, tg_post_link: str, task_id: int = None) -> List[dict]:
+    """Тело api_send_views: выбор тарифов и отправка заказов (вызывается под _API_SEND_SEM)"""
     transactions = []
     
     try:
         log.debug(f"🔍 Начало api_send_views для {views_count} просмотров")
         
-        with get_session() as session:
+        # Одна сессия на весь вызов: настройки (с тарифами), ротация и проверка очередей
+        with get_session() as session, _query_budget(session):
             log.debug(f"🔍 Получение настроек бустера")
             settings = get_booster_settings(session)
             if not settings or not settings.api_key:
@@ -182,20 +351,17 @@ async def api_send_views(views_count: int, tg_post_link: str, task_id: int = Non
             api_key = settings.api_key
             log.debug(f"🔍 API ключ получен")
         
-        # 1. Вычисляем 25% от общего количества
-        primary_views_needed = min(50, int(views_count * 0.25))
-        log.debug(f"🔍 25% просмотров: {primary_views_needed}")
-        
-        # 2. Получаем тарифы для модуля new_views
-        with get_session() as session:
-            log.debug(f"🔍 Получение тарифов из БД")
-            all_tariffs_stmt = select(BoosterTariff).where(
-                BoosterTariff.booster_id == settings.id,
-                BoosterTariff.module == "new_views",
-                BoosterTariff.is_active == True,
-                BoosterTariff.min_limit <= views_count
+            # 1. Вычисляем 25% от общего количества
+            primary_views_needed = min(50, int(views_count * 0.25))
+            log.debug(f"🔍 25% просмотров: {primary_views_needed}")
+            
+            # 2. Тарифы для модуля new_views — из уже загруженных settings.tariffs, без отдельного запроса
+            # Сортируем по min_limit один раз: подходящие под остаток тарифы — префикс списка (bisect)
+            all_tariffs = sorted(
+                (tariff for tariff in settings.tariffs
+                 if tariff.module == "new_views" and tariff.is_active and tariff.min_limit <= views_count),
+                key=_MIN_LIMIT,
             )
-            all_tariffs = session.execute(all_tariffs_stmt).scalars().all()
             log.debug(f"🔍 Найдено {len(all_tariffs)} тарифов")
         
             # Получаем или создаем экземпляр ротации для модуля new_views
@@ -251,16 +417,14 @@ async def api_send_views(views_count: int, tg_post_link: str, task_id: int = Non
             # Получаем тариф для оставшихся просмотров
             secondary_tariff = None
             if remaining_views > 0:
-                # Ищем тариф без очереди для оставшихся просмотров
-                possible_secondary_tariffs = []
-                for tariff in available_tariffs:
-                    if (tariff.service_id != primary_tariff.service_id and 
-                        tariff.min_limit <= remaining_views):
-                        possible_secondary_tariffs.append(tariff)
+                # Ищем тариф без очереди для оставшихся просмотров: min_limit <= remaining_views
+                eligible = available_tariffs[:bisect_right(available_tariffs, remaining_views, key=_MIN_LIMIT)]
+                possible_secondary_tariffs = [
+                    tariff for tariff in eligible if tariff.service_id != primary_tariff.service_id
+                ]
                 
                 if possible_secondary_tariffs:
-                    # Выбираем случайный тариф из доступных
-                    import random
+                    # Выбираем случайный тариф из доступных (весов у тарифов нет — равные шансы)
                     secondary_tariff = random.choice(possible_secondary_tariffs)
                 else:
                     # Если нет подходящих вторичных тарифов, отправляем все через основной
@@ -291,45 +455,41 @@ async def api_send_views(views_count: int, tg_post_link: str, task_id: int = Non
                 
                 return transactions
             else:
-                # 5. Отправляем 25% через основной тариф
+                # 5. 25% через основной тариф и 6. остаток через вторичный — заказы независимы,
+                # поэтому отправляем их параллельно
+                legs = [(primary_tariff, primary_views_needed)]
                 log.info(f"📊 Отправляем {primary_views_needed} через тариф service_id={primary_tariff.service_id}")
                 
-                order_id_1, price_1 = await _send_single_order(
-                    service_id=primary_tariff.service_id,
-                    tg_post_link=tg_post_link,
-                    api_key=api_key,
-                    quantity=primary_views_needed,
-                    task_id=task_id,
-                    task_type="new_views"
-                )
-                
-                if order_id_1 and price_1 > 0:
-                    transactions.append({
-                        "service_id": primary_tariff.service_id,
-                        "views_count": primary_views_needed,
-                        "price": price_1,
-                        "order_id": order_id_1
-                    })
-                
-                # 6. Отправляем оставшиеся просмотры через вторичный тариф
                 if remaining_views > 0 and secondary_tariff:
+                    legs.append((secondary_tariff, remaining_views))
                     log.info(f"📊 Отправляем {remaining_views} через тариф service_id={secondary_tariff.service_id}")
-                    
-                    order_id_2, price_2 = await _send_single_order(
-                        service_id=secondary_tariff.service_id,
-                        tg_post_link=tg_post_link,
-                        api_key=api_key,
-                        quantity=remaining_views,
-                        task_id=task_id,
-                        task_type="new_views"
-                    )
-                    
-                    if order_id_2 and price_2 > 0:
+                
+                results = await asyncio.gather(
+                    *(
+                        _send_single_order(
+                            service_id=tariff.service_id,
+                            tg_post_link=tg_post_link,
+                            api_key=api_key,
+                            quantity=quantity,
+                            task_id=task_id,
+                            task_type="new_views"
+                        )
+                        for tariff, quantity in legs
+                    ),
+                    return_exceptions=True
+                )
+                
+                for (tariff, quantity), result in zip(legs, results):
+                    if isinstance(result, BaseException):
+                        log.error(f"❌ Ошибка отправки заказа для service_id {tariff.service_id}: {result}")
+                        continue
+                    order_id, price = result
+                    if order_id and price > 0:
                         transactions.append({
-                            "service_id": secondary_tariff.service_id,
-                            "views_count": remaining_views,
-                            "price": price_2,
-                            "order_id": order_id_2
+                            "service_id": tariff.service_id,
+                            "views_count": quantity,
+                            "price": price,
+                            "order_id": order_id
                         })
                 
                 return transactions
@@ -338,12 +498,16 @@ async def api_send_views(views_count: int, tg_post_link: str, task_id: int = Non
         log.error(f"💥 Критическая ошибка: {e}")
         return transactions
 
+# Предупреждение о запросе status вместо charge из add пишем в лог один раз за процесс
+_STATUS_FALLBACK_WARNED = False
+
 async def _send_single_order(service_id: int, tg_post_link: str, api_key: str, quantity: int, 
                             task_id: int = None, task_type: str = "new_views") -> Tuple[Optional[str], float]:
     """Отправляет один заказ и сохраняет его в БД"""
+    global _STATUS_FALLBACK_WARNED
     try:
-        params = f"service={service_id}&link={tg_post_link}&quantity={quantity}"
-        success, result, error = _safe_twiboost_get("add", api_key, params)
+        params = {"service": service_id, "link": tg_post_link, "quantity": quantity}
+        success, result, error = await _safe_twiboost_get("add", api_key, params, idempotent=False)
         
         if not success:
             log.error(f"❌ Ошибка API для service_id {service_id}: {error}")
@@ -356,110 +520,237 @@ async def _send_single_order(service_id: int, tg_post_link: str, api_key: str, q
         
         log.info(f"✅ Заказ создан успешно, order={order_id}")
         
-        # Сохраняем заказ в БД
-        with get_session() as session:
-            from models import BoosterOrder
-            booster_order = BoosterOrder(
-                task_id=task_id,
-                task_type=task_type,
-                service_id=service_id,
-                external_order_id=str(order_id),
-                quantity=quantity,
-                price=0.0,
-                status='pending'
-            )
-            session.add(booster_order)
-            session.flush()
+        # Сначала получаем цену, затем пишем заказ в БД одной вставкой (без INSERT + UPDATE).
+        # Если API вернул charge прямо в ответе add — второй запрос (status) не нужен
+        if "charge" in result:
+            success = True
+            charge = float(result["charge"] or 0.0)
+        else:
+            if not _STATUS_FALLBACK_WARNED:
+                _STATUS_FALLBACK_WARNED = True
+                log.warning("⚠️ Ответ add не содержит charge — цену заказа запрашиваем через status")
+            success, status_data, error = await _safe_twiboost_get("status", api_key, {"order": order_id})
+            if success:
+                charge = float(status_data.get("charge", 0.0))
+            else:
+                log.error(f"❌ Ошибка API (status): {error}")
+                charge = 0.0
+        
+        # Заказ сохраняем в любом случае: без цены он остаётся в статусе pending.
+        # Запись — через общую очередь, писатель коммитит пачкой
+        queue_db_write("order", BoosterOrder(
+            task_id=task_id,
+            task_type=task_type,
+            service_id=service_id,
+            external_order_id=str(order_id),
+            quantity=quantity,
+            price=charge,
+            status='in_progress' if success else 'pending'
+        ))
         
-        # Получаем цену
-        success, status_data, error = _safe_twiboost_get("status", api_key, f"order={order_id}")
         if not success:
-            log.error(f"❌ Ошибка API (status): {error}")
             return None, 0.0
         
-        charge = status_data.get("charge", 0.0)
-        
-        # Обновляем заказ с ценой
-        with get_session() as session:
-            from sqlalchemy import update
-            from models import BoosterOrder
-            
-            stmt = update(BoosterOrder).where(
-                BoosterOrder.external_order_id == str(order_id)
-            ).values(
-                price=float(charge),
-                status='in_progress',
-                updated_at=datetime.utcnow()
-            )
-            session.execute(stmt)
-            session.commit()
-        
-        return str(order_id), float(charge)
+        return str(order_id), charge
         
     except Exception as e:
         log.error(f"❌ Ошибка отправки заказа для service_id {service_id}: {e}")
         return None, 0.0
 
 
+# Очередь записи заказов и расходов: один писатель коммитит до DB_WRITE_BATCH записей за раз
+DB_WRITE_BATCH = 50
+DB_WRITE_DELAY = 0.5  # сколько ждём добора пачки, секунд
+_DB_WRITE_Q: asyncio.Queue = asyncio.Queue()
+_DB_WRITER_TASK: Optional[asyncio.Task] = None
+
+def queue_db_write(op: str, payload):
+    """
+    Ставит запись в очередь: ("order", BoosterOrder) или ("expense", (ViewBoostExpense, external_order_id)).
+    Писатель запускается при первой записи.
+    """
+    global _DB_WRITER_TASK
+    if _DB_WRITER_TASK is None or _DB_WRITER_TASK.done():
+        _DB_WRITER_TASK = asyncio.create_task(_db_writer())
+    _DB_WRITE_Q.put_nowait((op, payload))
+
+async def _db_writer():
+    """Забирает из очереди пачку (до DB_WRITE_BATCH или DB_WRITE_DELAY) и пишет её одной транзакцией"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _DB_WRITE_Q.get()]
+        deadline = loop.time() + DB_WRITE_DELAY
+        while len(batch) < DB_WRITE_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_DB_WRITE_Q.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            _write_batch(batch)
+        finally:
+            for _ in batch:
+                _DB_WRITE_Q.task_done()
+
+def _write_batch(batch: list):
+    """
+    Одна сессия и один commit на пачку заказов и расходов.
+    Это оплаченные заказы: если пачка не записалась, пишем её по одной записи,
+    чтобы одна плохая строка не потянула за собой остальные.
+    """
+    try:
+        _write_items(batch)
+        log.debug(f"💾 Записано в БД: {len(batch)} (заказы и расходы)")
+    except Exception as e:
+        if len(batch) == 1:
+            log.error(f"❌ Не удалось записать в БД {_describe_write(batch[0])}: {e}")
+            return
+        log.warning(f"⚠️ Ошибка пакетной записи в БД ({len(batch)} записей), пишем по одной: {e}")
+        # Порядок очереди сохраняем: расход обновляет уже записанный заказ
+        for item in batch:
+            _write_batch([item])
+
+def _describe_write(item) -> str:
+    """Описание записи для лога, чтобы потерянный заказ можно было найти и досоздать вручную"""
+    op, payload = item
+    if op == "order":
+        return f"заказ {payload.external_order_id} (задача #{payload.task_id}, {payload.quantity} шт.)"
+    expense, order_id = payload
+    return f"расход по заказу {order_id} (задача #{expense.task_id}, {expense.views_count} просмотров)"
+
+def _write_items(batch: list):
+    """Пишет записи одной транзакцией; ошибка пробрасывается (get_session откатывает сессию)"""
+    with get_session() as session:
+        expenses = []
+        for op, payload in batch:
+            if op == "order":
+                session.add(payload)
+            else:
+                expense, order_id = payload
+                session.add(expense)
+                expenses.append((expense, order_id))
+        session.flush()  # Получаем ID расходов
+        
+        # Обновляем заказы в БД с expense_id
+        now = datetime.utcnow()
+        for expense, order_id in expenses:
+            if order_id:
+                session.execute(
+                    update(BoosterOrder)
+                    .where(BoosterOrder.external_order_id == order_id)
+                    .values(expense_id=expense.id, updated_at=now)
+                )
+        
+        session.commit()
+
+async def flush_db_writes():
+    """Дописывает очередь и останавливает писателя (при остановке модуля)"""
+    global _DB_WRITER_TASK
+    if _DB_WRITER_TASK is None:
+        return
+    if not _DB_WRITER_TASK.done():
+        await _DB_WRITE_Q.join()
+        _DB_WRITER_TASK.cancel()
+        try:
+            await _DB_WRITER_TASK
+        except asyncio.CancelledError:
+            pass
+    _DB_WRITER_TASK = None
+
+
 class TrackedPost:
     """Отслеживаемый пост"""
     
     def __init__(self, message_id: int, post_type: str, total_views_needed: int, 
                  publish_time: datetime, task_id: int, channel_telegram_id: int, 
-                 channel_username: str = None, entity_timezone=None):
+                 channel_username: str = None, entity_timezone=None,
+                 process_sem: Optional[asyncio.Semaphore] = None):
         self.message_id = message_id
         self.post_type = post_type  # "morning", "day", "evening", "night"
         self.total_views_needed = total_views_needed
         self.publish_time = publish_time
+        self._publish_epoch = publish_time.timestamp()
+        self._publish_mono = None  # задаётся в process() по loop.time()
         self.task_id = task_id
         self.channel_telegram_id = channel_telegram_id
         self.channel_username = channel_username
+        # Ссылка на пост не меняется — формируем один раз
+        if channel_username:
+            self._tg_post_link = f"https://t.me/{channel_username}/{message_id}"
+        else:
+            self._tg_post_link = f"https://t.me/c/{abs(channel_telegram_id)}/{message_id}"
         self.entity_timezone = entity_timezone or TZ
         self.completed_hours = set()
         self.is_running = True
         self.last_processed_hour = None
         self.last_processed_day = None
         self.original_total_views = total_views_needed
+        # Проценты распределения по часам (см. _get_hour_percents)
+        self._distributions = None
+        self._hour_percents: Dict[str, array] = {}
+        # Общий семафор трекера: ограничивает одновременные отправки по часам в одном канале
+        self._process_sem = process_sem
+        # Будит спящий process() при остановке
+        self._stop_event = asyncio.Event()
         
     def _get_tg_post_link(self):
-        """Формирует ссылку на пост в Telegram"""
-        if self.channel_username:
-            return f"https://t.me/{self.channel_username}/{self.message_id}"
-        else:
-            chat_id = abs(self.channel_telegram_id)
-            return f"https://t.me/c/{chat_id}/{self.message_id}"
+        """Ссылка на пост в Telegram (посчитана один раз в __init__)"""
+        return self._tg_post_link
     
     async def process(self):
-        """Основной процесс обработки поста"""
-        start_time = datetime.now(self.entity_timezone)
+        """
+        Основной процесс обработки поста.
+        Вместо опроса раз в минуту спим до начала следующего относительного часа (publish_time + hour - 1)
+        и обрабатываем его сразу; после 24-го часа ждём окончания суток с момента публикации.
+        """
         log.info(f"🚀 Начата обработка поста {self.message_id} для задачи #{self.task_id}, "
                 f"изначальное количество просмотров: {self.original_total_views}")
         
-        # Обрабатываем пост в течение 24 часов
-        while datetime.now(self.entity_timezone) < start_time + timedelta(hours=24) and self.is_running:
+        # Момент публикации на монотонных часах event loop: дальше сон считаем без datetime/tz
+        loop = asyncio.get_running_loop()
+        self._publish_mono = loop.time() - (time_mod.time() - self._publish_epoch)
+        
+        # Часы до текущего уже прошли (пост подхвачен с опозданием) — их не догоняем
+        current_hour_info = self._get_current_hour_info()
+        first_hour = current_hour_info[1] if current_hour_info else 25
+        
+        for hour in range(first_hour, 25):
+            hour_info = ("day1", hour)
+            if hour_info in self.completed_hours:
+                continue
+            
+            if not await self._sleep_until((hour - 1) * 3600):
+                break
+            
             try:
-                current_time = datetime.now(self.entity_timezone)
-                
-                current_hour_info = self._get_current_hour_info()
-                
-                if current_hour_info and current_hour_info != self.last_processed_hour:
-                    # Проверяем, что текущее время соответствует расписанию отправки
-                    if await self._should_process_hour(current_hour_info):
-                        await self._process_hour(current_hour_info)
-                        self.last_processed_hour = current_hour_info
-                        self.completed_hours.add(current_hour_info)
-                    else:
-                        log.debug(f"⏰ Пропуск часа {current_hour_info} - не время для отправки")
-                
-                await asyncio.sleep(60)  # Проверяем каждую минуту
-                
+                if self._process_sem is not None:
+                    async with self._process_sem:
+                        await self._process_hour(hour_info)
+                else:
+                    await self._process_hour(hour_info)
+                self.last_processed_hour = hour_info
+                self.completed_hours.add(hour_info)
             except Exception as e:
                 log.error(f"❌ Ошибка в основном цикле обработки поста {self.message_id}: {e}")
-                await asyncio.sleep(60)
+        
+        # Держим пост активным до конца суток: иначе проверка истории подхватит его заново
+        await self._sleep_until(24 * 3600)
         
         self.is_running = False
         log.info(f"✅ Завершено отслеживание поста {self.message_id} (24 часа истекли)")
     
+    async def _sleep_until(self, seconds_after_publish: float) -> bool:
+        """Спит до publish_time + seconds_after_publish (прерывается stop()); False, если пост остановлен"""
+        delay = self._publish_mono + seconds_after_publish - asyncio.get_running_loop().time()
+        if delay > 0 and self.is_running:
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        return self.is_running
+    
     def _get_current_hour_info(self) -> Optional[tuple]:
         """
         Возвращает информацию о текущем часе для распределения просмотров.
@@ -469,72 +760,49 @@ class TrackedPost:
         Возвращает: (day_type, hour) или None если время вышло за пределы расписания
         """
         try:
-            now = datetime.now(self.entity_timezone)
-            time_since_publish = now - self.publish_time
+            # Секунды с публикации — по эпохе, без арифметики tz-aware datetime
+            seconds_since_publish = int(time_mod.time() - self._publish_epoch)
             
             # Один день: 24 часа от времени публикации
-            if time_since_publish <= timedelta(hours=24):
-                relative_hour = int(time_since_publish.total_seconds() / 3600) + 1
+            if seconds_since_publish <= 24 * 3600:
+                # Усечение к нулю, как int(): небольшой «минус» из-за рассинхрона часов — это час 1
+                relative_hour = int(seconds_since_publish / 3600) + 1 if seconds_since_publish < 0 \
+                    else seconds_since_publish // 3600 + 1
                 if 1 <= relative_hour <= 24:
                     log.debug(f"📅 Относительный час: {relative_hour} "
-                             f"(с момента публикации: {time_since_publish})")
+                             f"(с момента публикации: {timedelta(seconds=seconds_since_publish)})")
                     return ("day1", relative_hour)
             
-            log.debug(f"⏭️ Время вышло за пределы 24 часов: {time_since_publish}")
+            log.debug(f"⏭️ Время вышло за пределы 24 часов: {timedelta(seconds=seconds_since_publish)}")
             return None
             
         except Exception as e:
             log.error(f"❌ Ошибка расчета текущего часа: {e}")
             return None
 
-    async def _should_process_hour(self, hour_info: tuple) -> bool:
+    def _get_hour_percents(self, day_type: str) -> array:
         """
-        Проверяет, должно ли текущее время соответствовать расписанию отправки для данного часа.
-        Это предотвращает отправку просмотров не вовремя.
+        Проценты по часам для типа поста; таблица строится один раз и пересобирается,
+        только когда get_view_distributions вернул новые данные (после истечения кэша)
         """
-        try:
-            day_type, hour = hour_info
-            now = datetime.now(self.entity_timezone)
-            current_hour = now.hour
-            current_minute = now.minute
-            
-            # Для точной отправки проверяем, что мы в правильном временном интервале
-            # Используем относительные часы от времени публикации
-            expected_hour = (self.publish_time.hour + hour - 1) % 24
-            
-            # Допускаем отклонение +/- 30 минут для отправки
-            time_diff = abs(current_hour - expected_hour)
-            if time_diff == 0 and current_minute <= 30:
-                return True
-            elif time_diff == 1 and current_minute >= 30:
-                return True
-                
-            log.debug(f"⏰ Пропуск: текущий час {current_hour}:{current_minute}, ожидаемый ~{expected_hour}:00-30")
-            return False
-            
-        except Exception as e:
-            log.error(f"❌ Ошибка проверки времени отправки: {e}")
-            return True  # В случае ошибки разрешаем отправку
+        with get_session() as session:
+            distributions = get_view_distributions(session)
+        
+        if distributions is not self._distributions:
+            self._distributions = distributions
+            self._hour_percents = {}
+        
+        table = self._hour_percents.get(day_type)
+        if table is None:
+            distribution = distributions[_POST_TYPE_INDEX.get(self.post_type, 3)]
+            table = self._hour_percents[day_type] = build_hour_percents(distribution, day_type)
+        return table
     
     async def _process_hour(self, hour_info: tuple):
         """Обрабатывает конкретный час согласно расписанию"""
         day_type, hour = hour_info
         
-        with get_session() as session:
-            MORNING_POST_DISTRIBUTION, DAY_POST_DISTRIBUTION, EVENING_POST_DISTRIBUTION, NIGHT_POST_DISTRIBUTION = get_view_distributions(session)
-        
-        # Выбираем распределение
-        if self.post_type == "morning":
-            distribution = MORNING_POST_DISTRIBUTION
-        elif self.post_type == "day":
-            distribution = DAY_POST_DISTRIBUTION
-        elif self.post_type == "evening":
-            distribution = EVENING_POST_DISTRIBUTION
-        else:
-            distribution = NIGHT_POST_DISTRIBUTION
-        
-        day_distribution = distribution.get(day_type, {})
-        hour_percent = day_distribution.get(str(hour)) or day_distribution.get(hour) or 0
+        hour_percent = self._get_hour_percents(day_type)[hour]
         
         if hour_percent > 0:
             views_needed = int(self.original_total_views * hour_percent / 100)
@@ -592,42 +860,26 @@ class TrackedPost:
     # Обновить метод _save_expense в TrackedPost:
     async def _save_expense(self, views_count: int, price: float, hour_percent: float, 
                            day_type: str, hour: int, service_id: int, order_id: str = None):
-        """Сохраняет информацию о расходе"""
+        """Сохраняет информацию о расходе (через очередь записи; expense_id заказу проставит писатель)"""
         try:
-            with get_session() as session:
-                expense = ViewBoostExpense(
-                    task_id=self.task_id,
-                    views_count=views_count,
-                    service_id=service_id,  # ⚠️ Реальный service_id из API
-                    price=price,
-                    # created_at автоматически
-                )
-                session.add(expense)
-                session.flush()  # Получаем ID расхода
-                
-                # Обновляем заказ в БД с expense_id
-                if order_id:
-                    from models import BoosterOrder
-                    from sqlalchemy import update
-                    
-                    stmt = update(BoosterOrder).where(
-                        BoosterOrder.external_order_id == order_id
-                    ).values(
-                        expense_id=expense.id,
-                        updated_at=datetime.utcnow()
-                    )
-                    session.execute(stmt)
-                
-                session.commit()
-                
-                log.debug(f"💾 Сохранен расход: {views_count} просмотров, "
-                         f"service_id={service_id}, цена={price}, order={order_id}")
+            expense = ViewBoostExpense(
+                task_id=self.task_id,
+                views_count=views_count,
+                service_id=service_id,  # ⚠️ Реальный service_id из API
+                price=price,
+                # created_at автоматически
+            )
+            queue_db_write("expense", (expense, order_id))
+            
+            log.debug(f"💾 Расход поставлен в очередь записи: {views_count} просмотров, "
+                     f"service_id={service_id}, цена={price}, order={order_id}")
         except Exception as e:
             log.error(f"❌ Ошибка сохранения расхода: {e}")
     
     def stop(self):
         """Останавливает обработку поста"""
         self.is_running = False
+        self._stop_event.set()
 
 class PostTracker:
     """Трекер для отслеживания постов и управления просмотрами"""
@@ -639,26 +891,76 @@ class PostTracker:
         self.message_handlers = []
         self.target_entity = None
         self.target = None
+        # Альбомы в реальном времени: grouped_id -> (id первой увиденной части, time.monotonic())
+        self.seen_albums: Dict[int, Tuple[int, float]] = {}
+        # (эпоха публикации, message_id) для cleanup_old_posts: вершина — самый старый пост
+        self._expiry_heap: List[Tuple[float, int]] = []
+        # Не больше PROCESS_CONCURRENCY постов канала одновременно отправляют просмотры
+        self._process_sem = asyncio.Semaphore(PROCESS_CONCURRENCY)
+        # Последний результат _get_fresh_task_data: (time.monotonic(), (task, target))
+        self._fresh_cache: Optional[Tuple[float, tuple]] = None
+        # Часовой пояс канала: считается один раз на (target.id, country_id)
+        self._entity_tz = None
+        self._entity_tz_key: Optional[Tuple[int, Optional[int]]] = None
+        # telegram_id -> сущность канала и какой запрос отдал полную информацию ("channel" / "chat")
+        self._channel_entity_cache: Dict[int, Any] = {}
+        self._channel_kind_cache: Dict[int, str] = {}
+        # (target.link, вычисленный channel_username) — ссылка канала меняется редко
+        self._channel_username_cache: Tuple[Optional[str], Optional[str]] = (None, None)
+        
+    def _get_entity_tz(self, target: MainEntity):
+        """Часовой пояс канала из кэша трекера; пересчитывается при смене канала или его страны"""
+        key = (target.id, target.country_id)
+        if self._entity_tz is None or self._entity_tz_key != key:
+            self._entity_tz = get_entity_timezone(target)
+            self._entity_tz_key = key
+        return self._entity_tz
+    
+    def _get_channel_username(self, target: MainEntity) -> Optional[str]:
+        """Username канала из ссылки; пересчитывается только при смене target.link"""
+        link, channel_username = self._channel_username_cache
+        if link != target.link:
+            channel_username = None
+            if target.link:
+                channel_username = target.link.replace('https://t.me/', '').replace('@', '')
+            self._channel_username_cache = (target.link, channel_username)
+        return channel_username
         
     def _get_fresh_task_data(self) -> Tuple[Optional[ViewBoostTask], Optional[MainEntity]]:
-        """Получает СВЕЖИЕ данные задачи и целевого канала из БД"""
+        """
+        Получает СВЕЖИЕ данные задачи и целевого канала из БД.
+        При всплеске сообщений результат переиспользуется FRESH_TASK_TTL секунд.
+        """
+        cached = self._fresh_cache
+        if cached and time_mod.monotonic() - cached[0] < FRESH_TASK_TTL:
+            return cached[1]
+        
         try:
             with get_session() as session:
                 stmt = (
                     select(ViewBoostTask)
                     .where(ViewBoostTask.id == self.task_id)
                     .options(
-                        joinedload(ViewBoostTask.target).joinedload(MainEntity.country)
+                        # Загружаем ровно target и его country; любые другие связи (bot, expenses,
+                        # category, ...) при обращении падают сразу, а не тихо делают N+1 запросы
+                        selectinload(ViewBoostTask.target).options(
+                            selectinload(MainEntity.country),
+                            raiseload("*"),
+                        ),
+                        raiseload("*"),
                     )
                 )
-                task = session.execute(stmt).unique().scalar_one_or_none()
+                task = session.execute(stmt).scalar_one_or_none()
                 
                 if task and task.is_active and task.target:
                     log.info(f"✅ Загружены актуальные данные задачи #{self.task_id} и канала {task.target.name}")
-                    return task, task.target
+                    result = (task, task.target)
                 else:
                     log.info(f"🛑 Задача #{self.task_id} неактивна или канал не найден")
-                    return None, None
+                    result = (None, None)
+                
+                self._fresh_cache = (time_mod.monotonic(), result)
+                return result
                     
         except Exception as e:
             log.error(f"❌ Ошибка загрузки задачи #{self.task_id}: {e}")
@@ -713,19 +1015,15 @@ class PostTracker:
             
             # Обрабатываем только ПЕРВУЮ часть альбома
             if hasattr(message, 'grouped_id') and message.grouped_id is not None:
-                # Проверяем, является ли это сообщение первой частью альбома
-                # Для этого сравниваем его ID с другими сообщениями в том же альбоме
-                # Первой частью считаем сообщение с наименьшим ID в группе
-                async for other_message in self.client.iter_messages(
-                    self.target_entity, 
-                    limit=10  # Проверяем ближайшие сообщения
-                ):
-                    if (hasattr(other_message, 'grouped_id') and 
-                        other_message.grouped_id == message.grouped_id and 
-                        other_message.id < message.id):
-                        # Нашли сообщение с меньшим ID в той же группе - пропускаем текущее
-                        log.debug(f"⏭️ Пропуск части альбома {message.grouped_id}, сообщение {message.id} (не первое)")
-                        return
+                # Трекер запускается по первой пришедшей части альбома; остальные части пропускаем,
+                # лишь запоминая наименьший ID — запрос истории в Telegram не нужен
+                prev = self.seen_albums.get(message.grouped_id)
+                if prev is not None:
+                    if message.id < prev[0]:
+                        self.seen_albums[message.grouped_id] = (message.id, prev[1])
+                    log.debug("⏭️ Пропуск части альбома %s, сообщение %s (не первое)", message.grouped_id, message.id)
+                    return
+                self.seen_albums[message.grouped_id] = (message.id, time_mod.monotonic())
                 
                 log.info(f"🎯 Обрабатываем ПЕРВУЮ часть альбома {message.grouped_id}, сообщение {message.id}")
             # Если это не альбом или это первая часть альбома - продолжаем обработку
@@ -750,11 +1048,11 @@ class PostTracker:
         try:
             # Преобразование времени в часовой пояс канала
             if message.date.tzinfo is None:
-                utc_time = UTC_TZ.localize(message.date)
+                utc_time = message.date.replace(tzinfo=UTC_TZ)
             else:
                 utc_time = message.date
             
-            entity_tz = get_entity_timezone(target)
+            entity_tz = self._get_entity_tz(target)
             message_time_local = utc_time.astimezone(entity_tz)
             
             # ИЗМЕНЕНИЕ: проверяем, что пост опубликован не более 24 часов назад
@@ -762,7 +1060,7 @@ class PostTracker:
             time_diff = current_time_local - message_time_local
             
             if time_diff > timedelta(hours=24):
-                log.debug(f"⏭️ Пропуск старого сообщения {message.id} (разница: {time_diff}, больше 24 часов)")
+                log.debug("⏭️ Пропуск старого сообщения %s (разница: %s, больше 24 часов)", message.id, time_diff)
                 return
             
             # ИСПРАВЛЕНИЕ: правильное определение типа поста с 4 режимами
@@ -774,9 +1072,7 @@ class PostTracker:
                 total_views_needed = 100
                 log.warning(f"⚠️ Установлено минимальное количество просмотров: {total_views_needed}")
             
-            channel_username = None
-            if target.link:
-                channel_username = target.link.replace('https://t.me/', '').replace('@', '')
+            channel_username = self._get_channel_username(target)
             
             tracked_post = TrackedPost(
                 message_id=message.id,
@@ -786,17 +1082,20 @@ class PostTracker:
                 task_id=self.task_id,
                 channel_telegram_id=target.telegram_id,
                 channel_username=channel_username,
-                entity_timezone=entity_tz  # Передаем часовой пояс канала
+                entity_timezone=entity_tz,  # Передаем часовой пояс канала
+                process_sem=self._process_sem
             )
             
             self.active_posts[message.id] = tracked_post
+            heapq.heappush(self._expiry_heap, (tracked_post._publish_epoch, message.id))
             
             # ИЗМЕНЕНИЕ: логируем оставшееся время для обработки (24 часа)
             time_remaining = timedelta(hours=24) - time_diff
-            log.info(f"🎯 Начато отслеживание поста {message.id} для задачи #{self.task_id} "
-                    f"(тип: {post_type}, нужно просмотров: {total_views_needed}, "
-                    f"время публикации: {message_time_local.strftime('%Y-%m-%d %H:%M')} {entity_tz}, "
-                    f"осталось времени: {time_remaining})")
+            # Вызывается на каждое сообщение — DEBUG с ленивым форматированием
+            log.debug("🎯 Начато отслеживание поста %s для задачи #%s "
+                      "(тип: %s, нужно просмотров: %s, время публикации: %s, осталось времени: %s)",
+                      message.id, self.task_id, post_type, total_views_needed,
+                      message_time_local, time_remaining)
             
             # Запускаем асинхронную обработку поста
             asyncio.create_task(tracked_post.process())
@@ -818,58 +1117,44 @@ class PostTracker:
             log.info(f"🔍 Проверка исторических сообщений в канале {target.name}")
             
             # Используем entity_tz из уже загруженного target с country
-            entity_tz = get_entity_timezone(target)
+            entity_tz = self._get_entity_tz(target)
             
             # Получаем сообщения за последние 24 часа
-            messages = []
-            processed_albums = set()  # Для отслеживания уже обработанных альбомов
-            entity_tz = get_entity_timezone(target)
             current_time_entity = datetime.now(entity_tz)
             
-            async for message in self.client.iter_messages(
-                self.target_entity, 
-                limit=50
-            ):
-                # Пропускаем служебные сообщения
-                if isinstance(message, MessageService) or getattr(message, 'action', None):
-                    continue
-                    
-                # ИСПРАВЛЕНИЕ: для альбомов обрабатываем только первую часть
-                if hasattr(message, 'grouped_id') and message.grouped_id is not None:
-                    if message.grouped_id in processed_albums:
-                        log.debug(f"⏭️ Пропуск части альбома {message.grouped_id}, сообщение {message.id} (альбом уже обработан)")
-                        continue
-                    
-                    # Находим первую часть альбома (сообщение с наименьшим ID)
-                    first_message = message
-                    async for other_message in self.client.iter_messages(
-                        self.target_entity, 
-                        limit=20
-                    ):
-                        if (hasattr(other_message, 'grouped_id') and 
-                            other_message.grouped_id == message.grouped_id and 
-                            other_message.id < first_message.id):
-                            first_message = other_message
-                    
-                    # Если текущее сообщение не является первой частью - пропускаем
-                    if first_message.id != message.id:
-                        log.debug(f"⏭️ Пропуск части альбома {message.grouped_id}, сообщение {message.id} (не первое)")
+            # Один запрос истории; служебные сообщения отбрасываем сразу
+            msgs = [
+                message async for message in self.client.iter_messages(self.target_entity, limit=50)
+                if not isinstance(message, MessageService) and not getattr(message, 'action', None)
+            ]
+            
+            # ИСПРАВЛЕНИЕ: для альбомов обрабатываем только первую часть (наименьший ID в группе) —
+            # один проход по уже полученным сообщениям вместо повторных iter_messages на каждую часть
+            album_first: Dict[int, int] = {}
+            for message in msgs:
+                grouped_id = getattr(message, 'grouped_id', None)
+                if grouped_id is not None:
+                    album_first[grouped_id] = min(album_first.get(grouped_id, message.id), message.id)
+            
+            messages = []
+            for message in msgs:
+                grouped_id = getattr(message, 'grouped_id', None)
+                if grouped_id is not None:
+                    if album_first[grouped_id] != message.id:
+                        log.debug("⏭️ Пропуск части альбома %s, сообщение %s (не первое)", grouped_id, message.id)
                         continue
-                    
-                    # Помечаем альбом как обработанный
-                    processed_albums.add(message.grouped_id)
-                    log.info(f"🎯 Обрабатываем ПЕРВУЮ часть альбома {message.grouped_id}, сообщение {message.id}")
+                    log.info(f"🎯 Обрабатываем ПЕРВУЮ часть альбома {grouped_id}, сообщение {message.id}")
                 
                 # Фильтруем по времени в часовом поясе канала
                 if message.date.tzinfo is None:
-                    message_utc = UTC_TZ.localize(message.date)
+                    message_utc = message.date.replace(tzinfo=UTC_TZ)
                 else:
                     message_utc = message.date
                 
                 message_time_entity = message_utc.astimezone(entity_tz)
                 time_diff = current_time_entity - message_time_entity
                 
-                # Берем посты за последние 24 часа
+                # Берем посты за последние 24 часа (история идёт от новых к старым)
                 if time_diff <= timedelta(hours=24):
                     messages.append(message)
                 else:
@@ -877,31 +1162,46 @@ class PostTracker:
             
             log.info(f"📨 Получено {len(messages)} исторических сообщений из канала {target.name} за последние 24 часа")
             
-            # Обрабатываем сообщения в обратном порядке (от старых к новым)
-            for message in reversed(messages):
-                await self._handle_new_message(message)
+            # Обрабатываем сообщения (от старых к новым) параллельно, не больше HISTORY_CONCURRENCY сразу:
+            # active_posts ключуется по message.id, так что порядок завершения не важен
+            sem = asyncio.Semaphore(HISTORY_CONCURRENCY)
+            
+            async def _bounded(message):
+                async with sem:
+                    await self._handle_new_message(message)
+            
+            await asyncio.gather(*(_bounded(message) for message in reversed(messages)))
                     
         except Exception as e:
             log.error(f"❌ Ошибка проверки исторических постов: {e}")
 
     async def cleanup_old_posts(self):
         """Очищает старые отслеживаемые посты"""
-        current_time = datetime.now(TZ)
-        posts_to_remove = []
+        # Следующее сообщение перечитает задачу из БД (выключение задачи подхватится сразу)
+        self._fresh_cache = None
         
-        for message_id, tracked_post in self.active_posts.items():
-            # Используем часовой пояс канала для расчета времени
-            current_time_entity = datetime.now(tracked_post.entity_timezone)
-            time_since_publish = current_time_entity - tracked_post.publish_time
-            
-            # ИЗМЕНЕНИЕ: удаляем посты старше 36 часов (24 + запас)
-            if (not tracked_post.is_running or 
-                time_since_publish > timedelta(hours=36)):
-                posts_to_remove.append(message_id)
+        # Забываем альбомы, увиденные дольше ALBUM_SEEN_TTL назад
+        expired_before = time_mod.monotonic() - ALBUM_SEEN_TTL
+        for grouped_id in [gid for gid, (_, seen_at) in self.seen_albums.items() if seen_at < expired_before]:
+            del self.seen_albums[grouped_id]
+        
+        now = time_mod.time()
+        heap = self._expiry_heap
         
-        for message_id in posts_to_remove:
-            if message_id in self.active_posts:
-                self.active_posts[message_id].stop()
+        # Куча по времени публикации: снимаем с вершины только устаревшие посты и останавливаемся
+        # на первом живом — остальные заведомо моложе (O(k log N) вместо прохода по всем постам)
+        while heap:
+            publish_epoch, message_id = heap[0]
+            tracked_post = self.active_posts.get(message_id)
+            
+            # ИЗМЕНЕНИЕ: удаляем посты старше 36 часов (24 + запас) и уже завершённые
+            if (tracked_post is not None and tracked_post.is_running and
+                    now - publish_epoch <= 36 * 3600):
+                break
+            
+            heapq.heappop(heap)
+            if tracked_post is not None and tracked_post._publish_epoch == publish_epoch:
+                tracked_post.stop()
                 del self.active_posts[message_id]
                 log.info(f"🗑️ Удален отслеживаемый пост {message_id} (старше 36 часов)")
     
@@ -911,23 +1211,11 @@ class PostTracker:
         Утро: 05:00-10:00, День: 10:00-16:00, Вечер: 16:00-22:00, Ночь: 22:00-05:00
         """
         try:
-            post_time = post_date.time()
-            
-            # Утро: с 5:00 до 10:00
-            if MORNING_START <= post_time < time(10, 0):
-                post_type = "morning"
-            # День: с 10:00 до 16:00
-            elif time(10, 0) <= post_time < time(16, 0):
-                post_type = "day"
-            # Вечер: с 16:00 до 22:00
-            elif time(16, 0) <= post_time < time(22, 0):
-                post_type = "evening"
-            # Ночь: с 22:00 до 5:00 следующего дня
-            else:
-                post_type = "night"
+            # Границы режимов — ровно на часах, поэтому достаточно индекса по часу
+            post_type = _POST_TYPE_BY_HOUR[post_date.hour]
                 
-            log.info(f"🕒 Определен тип поста: {post_type} "
-                    f"(время публикации: {post_time.strftime('%H:%M')} по времени канала)")
+            log.debug("🕒 Определен тип поста: %s (время публикации: %02d:%02d по времени канала)",
+                      post_type, post_date.hour, post_date.minute)
             return post_type
         except Exception as e:
             log.error(f"❌ Ошибка определения типа поста: {e}")
@@ -937,12 +1225,44 @@ class PostTracker:
         """Рассчитывает общее количество необходимых просмотров"""
         try:
             views = int((task.view_coefficient / 100) * task.subscribers_count)
-            log.info(f"📊 Расчет просмотров: {task.view_coefficient}% от {task.subscribers_count} подписчиков = {views} просмотров")
+            log.debug("📊 Расчет просмотров: %s%% от %s подписчиков = %s просмотров",
+                      task.view_coefficient, task.subscribers_count, views)
             return max(views, 100)  # Минимум 100 просмотров
         except Exception as e:
             log.error(f"❌ Ошибка расчета просмотров: {e}")
             return 100
 
+    async def _get_full_chat(self, target: MainEntity):
+        """
+        Полная информация о канале. Сущность и тип запроса (канал/чат) запоминаются
+        по telegram_id, так что повторные вызовы обходятся без get_entity и запроса-пробы.
+        """
+        channel = self._channel_entity_cache.get(target.telegram_id)
+        if channel is None:
+            target_entity = await ensure_peer(
+                self.client, 
+                telegram_id=target.telegram_id,
+                link=target.link
+            )
+            channel = await self.client.get_entity(target_entity)
+            self._channel_entity_cache[target.telegram_id] = channel
+        
+        kind = self._channel_kind_cache.get(target.telegram_id)
+        if kind == "channel":
+            return (await self.client(functions.channels.GetFullChannelRequest(channel))).full_chat
+        if kind == "chat":
+            return (await self.client(functions.messages.GetFullChatRequest(channel.id))).full_chat
+        
+        try:
+            # Для каналов
+            full = await self.client(functions.channels.GetFullChannelRequest(channel))
+            self._channel_kind_cache[target.telegram_id] = "channel"
+        except Exception:
+            # Для чатов и супергрупп
+            full = await self.client(functions.messages.GetFullChatRequest(channel.id))
+            self._channel_kind_cache[target.telegram_id] = "chat"
+        return full.full_chat
+
     async def update_subscribers_count(self):
         """Обновляет количество подписчиков в канале"""
         # ЗАГРУЖАЕМ СВЕЖИЕ ДАННЫЕ ЗАДАЧИ (уже с загруженной country)
@@ -953,31 +1273,23 @@ class PostTracker:
         try:
             log.info(f"👥 Обновление количества подписчиков для канала {target.name}")
             
-            # Используем entity_tz из уже загруженного target с country
-            entity_tz = get_entity_timezone(target)
-            target_entity = await ensure_peer(
-                self.client, 
-                telegram_id=target.telegram_id,
-                link=target.link
-            )
+            # Данные канала перечитаны — часовой пояс посчитаем заново
+            self._entity_tz = None
+            self._fresh_cache = None
             
-            # Получаем информацию о канале
-            channel = await self.client.get_entity(target_entity)
+            # Используем entity_tz из уже загруженного target с country
+            entity_tz = self._get_entity_tz(target)
             subscribers = 0
 
             try:
-                # Для каналов
-                full = await self.client(functions.channels.GetFullChannelRequest(channel))
-                if full.full_chat.participants_count:
-                    subscribers = full.full_chat.participants_count
+                full_chat = await self._get_full_chat(target)
+                if full_chat.participants_count:
+                    subscribers = full_chat.participants_count
             except Exception:
-                try:
-                    # Для чатов и супергрупп
-                    full = await self.client(functions.messages.GetFullChatRequest(channel.id))
-                    if full.full_chat.participants_count:
-                        subscribers = full.full_chat.participants_count
-                except Exception:
-                    log.warning(f"⚠️ Не удалось получить количество подписчиков для {target.name}")
+                # Канал могли пересоздать или сменить тип — в следующий раз резолвим заново
+                self._channel_entity_cache.pop(target.telegram_id, None)
+                self._channel_kind_cache.pop(target.telegram_id, None)
+                log.warning(f"⚠️ Не удалось получить количество подписчиков для {target.name}")
 
             subscribers = int(subscribers) if subscribers else 0
             log.info(f"📊 Получено подписчиков: {subscribers} для канала {target.name}")
@@ -999,6 +1311,15 @@ class PostTracker:
         # Telethon автоматически управляет обработчиками, поэтому просто очищаем список
         self.message_handlers.clear()
 
+async def _connect_client(bot: BotSession) -> TelegramClient:
+    """Подключает клиент бота одним connect(); неавторизованная сессия — ошибка (start() спросил бы телефон)"""
+    client = init_user_client(bot)
+    await client.connect()
+    if not await client.is_user_authorized():
+        await client.disconnect()
+        raise RuntimeError(f"Бот #{bot.id} не авторизован")
+    return client
+
 class ViewBoostManager:
     """Менеджер для управления всеми задачами умного просмотра"""
     
@@ -1006,6 +1327,8 @@ class ViewBoostManager:
         self.trackers: Dict[int, PostTracker] = {}
         self.clients: Dict[int, TelegramClient] = {}
         self.running = False
+        # task_id -> time.monotonic() последнего сканирования истории канала
+        self._last_history_check: Dict[int, float] = {}
         
     async def initialize(self):
         """Инициализация менеджера"""
@@ -1051,13 +1374,9 @@ class ViewBoostManager:
                         log.error(f"❌ Бот #{bot_id} не найден в базе данных")
                         continue
                         
-                    client = init_user_client(bot)
-                    await client.start()
-                    if not await client.is_user_authorized():
-                        raise RuntimeError(f"Бот #{bot_id} не авторизован")
-                    
-                    # ЗАПУСКАЕМ КЛИЕНТ В ФОНОВОМ РЕЖИМЕ ДЛЯ ПРОСЛУШИВАНИЯ
-                    await client.start()
+                    # Одно подключение: сессия уже авторизована (StringSession), события
+                    # начинают приходить сразу после connect()
+                    client = await _connect_client(bot)
                     
                     self.clients[bot_id] = client
                     log.info(f"✅ Бот #{bot_id} авторизован и запущен для прослушивания")
@@ -1065,18 +1384,39 @@ class ViewBoostManager:
                     log.error(f"❌ Ошибка инициализации бота #{bot_id}: {e}")
         
         # Создание трекеров
+        new_trackers = []
         for task in tasks:
             client = self.clients.get(task.bot_id)
             if client and task.id not in self.trackers:
                 tracker = PostTracker(task.id, client)
                 self.trackers[task.id] = tracker
+                new_trackers.append(tracker)
+        
+        await self._init_trackers(new_trackers, "Трекер создан")
+
+    async def _init_trackers(self, trackers: List[PostTracker], done_message: str):
+        """Инициализирует трекеры параллельно (каналы независимы), не больше TRACKER_INIT_CONCURRENCY сразу"""
+        sem = asyncio.Semaphore(TRACKER_INIT_CONCURRENCY)
+        
+        async def _init_tracker(tracker: PostTracker):
+            async with sem:
                 await tracker.update_subscribers_count()
                 
                 # Настраиваем обработчики событий и проверяем исторические сообщения
                 await tracker._setup_message_handler()
-                await tracker.check_historical_posts()
-                
-                log.info(f"✅ Трекер создан для задачи #{task.id}")
+                await self._check_history(tracker)
+            
+            log.info(f"✅ {done_message} для задачи #{tracker.task_id}")
+        
+        results = await asyncio.gather(*(_init_tracker(t) for t in trackers), return_exceptions=True)
+        for tracker, result in zip(trackers, results):
+            if isinstance(result, Exception):
+                log.error(f"❌ Ошибка инициализации трекера для задачи #{tracker.task_id}: {result}")
+
+    async def _check_history(self, tracker: PostTracker):
+        """Сканирует историю канала трекера и запоминает время сканирования"""
+        await tracker.check_historical_posts()
+        self._last_history_check[tracker.task_id] = time_mod.monotonic()
 
     async def check_for_updates(self):
         """Проверяет обновления в БД и обновляет трекеры"""
@@ -1100,31 +1440,32 @@ class ViewBoostManager:
                         for tracked_post in tracker.active_posts.values():
                             tracked_post.stop()
                         del self.trackers[task_id]
+                        self._last_history_check.pop(task_id, None)
                         log.info(f"🗑️ Удален трекер для задачи #{task_id}")
                 
                 # Добавляем новые трекеры
+                new_trackers = []
                 for task in active_tasks:
                     if task.id not in self.trackers:
                         client = self.clients.get(task.bot_id)
                         if client:
                             tracker = PostTracker(task.id, client)
                             self.trackers[task.id] = tracker
-                            await tracker.update_subscribers_count()
-                            
-                            # Настраиваем обработчики событий и проверяем исторические сообщения
-                            await tracker._setup_message_handler()
-                            await tracker.check_historical_posts()
-                            
-                            log.info(f"✅ Добавлен трекер для задачи #{task.id}")
+                            new_trackers.append(tracker)
                         else:
                             log.warning(f"⚠️ Не найден клиент для бота #{task.bot_id} для задачи #{task.id}")
                 
+                await self._init_trackers(new_trackers, "Добавлен трекер")
+                
                 # Обновляем существующие трекеры
                 for task in active_tasks:
                     if task.id in self.trackers:
                         tracker = self.trackers[task.id]
-                        # Проверяем исторические сообщения для существующих трекеров
-                        await tracker.check_historical_posts()
+                        # Новые посты ловит обработчик событий; история нужна лишь для пропущенных
+                        # (например, во время обрыва связи) — сканируем её не чаще HISTORY_RECHECK_INTERVAL
+                        last_check = self._last_history_check.get(task.id, 0.0)
+                        if time_mod.monotonic() - last_check > HISTORY_RECHECK_INTERVAL:
+                            await self._check_history(tracker)
                         
         except Exception as e:
             log.error(f"❌ Ошибка при проверке обновлений БД: {e}")
@@ -1149,9 +1490,7 @@ class ViewBoostManager:
                         stmt = select(BotSession).where(BotSession.id == bot_id)
                         bot = session.execute(stmt).scalar_one_or_none()
                         if bot:
-                            new_client = init_user_client(bot)
-                            await new_client.start()
-                            new_client.start()  # Запускаем в фоновом режиме
+                            new_client = await _connect_client(bot)
                             self.clients[bot_id] = new_client
                             log.info(f"✅ Клиент бота #{bot_id} перезапущен")
             except Exception as e:
@@ -1207,6 +1546,8 @@ async def run_view_booster():
         log.error(f"💥 Критическая ошибка в модуле умного просмотра: {e}")
     finally:
         await manager.cleanup()
+        await flush_db_writes()
+        await close_aiohttp_session()
         log.info("🛑 Модуль умного просмотра остановлен")
 
 if __name__ == "__main__":